@@ -29,4 +29,25 @@ class LocalPaths:
     
     ### masterディレクトリのパス
     MASTER_DIR: str = os.path.join(DATA_DIR, 'master')
-    MASTER_RAW_HORSE_RESULTS_PATH: str = os.path.join(MASTER_DIR, 'horse_results_updated_at.csv')
\ No newline at end of file
+    MASTER_RAW_HORSE_RESULTS_PATH: str = os.path.join(MASTER_DIR, 'horse_results_updated_at.csv')
+    ## horse_idなどのラベルエンコーディング用の対応表
+    MASTER_DB_PATH: str = os.path.join(MASTER_DIR, 'id_master.db')
+    ## 特徴量選択で残した特徴量の一覧
+    FEATURE_SPEC_PATH: str = os.path.join(MASTER_DIR, 'feature_spec.json')
+    
+    ### tmpディレクトリのパス
+    TMP_DIR: str = os.path.join(DATA_DIR, 'tmp')
+    ## 差分マージ用の、馬の過去成績の集計まで済んだデータ
+    MERGED_HORSE_RESULTS_PATH: str = os.path.join(TMP_DIR, 'merged_horse_results.pickle')
+    ## 当日予想用の、馬ごとの過去成績の集計値
+    HORSE_RESULTS_SNAPSHOT_PATH: str = os.path.join(TMP_DIR, 'horse_results_snapshot.pickle')
+    ## optuna用のLightGBMのバイナリデータセット
+    LGB_DATASET_DIR: str = os.path.join(TMP_DIR, 'lgb_dataset')
+    
+    ### optunaディレクトリのパス
+    OPTUNA_DIR: str = os.path.join(DATA_DIR, 'optuna')
+    ## ハイパーパラメータチューニングの記録
+    OPTUNA_DB_PATH: str = os.path.join(OPTUNA_DIR, 'optuna.db')
+    
+    ### feature_storeディレクトリのパス
+    FEATURE_STORE_DIR: str = os.path.join(DATA_DIR, 'feature_store')
\ No newline at end of file
@@ -18,6 +18,10 @@ class AbstractBetPolicy(metaclass=ABCMeta):
         '202101010103': {'tansho': [6], 'fukusho': []},
         '202101010104': {'tansho': [5], 'fukusho': [11]},
         ...}
+
+        スコアがthreshold以上の馬を、1種類の馬券で賭ける戦略は、
+        馬券の種類BET_TYPEと、賭けるのに必要な頭数MIN_HORSESを持たせると、
+        Simulator.sweepで複数のthresholdの成績をまとめて計算できる。
         """
         pass
 
@@ -25,6 +29,9 @@ class BetPolicyTansho:
     """
     thresholdを超えた馬に単勝で賭ける戦略。
     """
+    BET_TYPE = 'tansho'
+    MIN_HORSES = 1
+
     @staticmethod
     def judge(score_table: pd.DataFrame, threshold: float) -> dict:
         filtered_table = score_table[score_table['score'] >= threshold]
@@ -36,6 +43,9 @@ class BetPolicyFukusho:
     """
     thresholdを超えた馬に複勝で賭ける戦略。
     """
+    BET_TYPE = 'fukusho'
+    MIN_HORSES = 1
+
     @staticmethod
     def judge(score_table: pd.DataFrame, threshold: float) -> dict:
         filtered_table = score_table[score_table['score'] >= threshold]
@@ -47,6 +57,9 @@ class BetPolicyUmarenBox:
     """
     thresholdを超えた馬に馬連BOXで賭ける戦略。
     """
+    BET_TYPE = 'umaren'
+    MIN_HORSES = 2
+
     def judge(score_table: pd.DataFrame, threshold: float) -> dict:
         filtered_table = score_table[score_table['score'] >= threshold]
         bet_df = filtered_table.groupby(level=0)[ResultsCols.UMABAN].apply(list).to_frame()
@@ -58,6 +71,9 @@ class BetPolicyUmatanBox:
     """
     thresholdを超えた馬に馬単BOXで賭ける戦略。
     """
+    BET_TYPE = 'umatan'
+    MIN_HORSES = 2
+
     def judge(score_table: pd.DataFrame, threshold: float) -> dict:
         filtered_table = score_table[score_table['score'] >= threshold]
         bet_df = filtered_table.groupby(level=0)[ResultsCols.UMABAN].apply(list).to_frame()
@@ -69,6 +85,9 @@ class BetPolicyWideBox:
     """
     thresholdを超えた馬にワイドBOXで賭ける戦略。
     """
+    BET_TYPE = 'wide'
+    MIN_HORSES = 2
+
     def judge(score_table: pd.DataFrame, threshold: float) -> dict:
         filtered_table = score_table[score_table['score'] >= threshold]
         bet_df = filtered_table.groupby(level=0)[ResultsCols.UMABAN].apply(list).to_frame()
@@ -80,6 +99,9 @@ class BetPolicySanrenpukuBox:
     """
     thresholdを超えた馬に三連複BOXで賭ける戦略。
     """
+    BET_TYPE = 'sanrenpuku'
+    MIN_HORSES = 3
+
     def judge(score_table: pd.DataFrame, threshold: float) -> dict:
         filtered_table = score_table[score_table['score'] >= threshold]
         bet_df = filtered_table.groupby(level=0)[ResultsCols.UMABAN].apply(list).to_frame()
@@ -91,6 +113,9 @@ class BetPolicySanrentanBox:
     """
     thresholdを超えた馬に三連単BOXで賭ける戦略。
     """
+    BET_TYPE = 'sanrentan'
+    MIN_HORSES = 3
+
     def judge(score_table: pd.DataFrame, threshold: float) -> dict:
         filtered_table = score_table[score_table['score'] >= threshold]
         bet_df = filtered_table.groupby(level=0)[ResultsCols.UMABAN].apply(list).to_frame()
@@ -1,6 +1,6 @@
 from abc import ABCMeta, abstractmethod
-from typing import Callable
 
+import numpy as np
 import pandas as pd
 
 from modules.constants import ResultsCols
@@ -12,18 +12,31 @@ _SCORE = 'score'
 
 # common funcs
 def _calc(model, X: pd.DataFrame) -> pd.DataFrame:
-    score_table = X[ResultsCols.UMABAN].to_frame().copy()
-    score = model.predict_proba(X)[:, 1]
-    score_table[_SCORE] = score
-    return score_table
+    # 馬番とスコアの配列から、スコアテーブルを一度に作る
+    return pd.DataFrame(
+        {ResultsCols.UMABAN: X[ResultsCols.UMABAN].to_numpy(), _SCORE: model.predict_proba(X)[:, 1]},
+        index=X.index
+        )
 
-def _apply_scaler(score: pd.Series, scaler: Callable[[pd.Series], pd.Series]) -> pd.Series:
-    return score.groupby(level=0, group_keys=False).apply(scaler)
+class _PrecomputedModel:
+    """
+    計算済みの予測値を、score_policyにモデルとして渡すためのクラス
+    """
+    def __init__(self, proba: np.ndarray):
+        self.__proba = proba
+
+    def predict_proba(self, X: pd.DataFrame) -> np.ndarray:
+        return self.__proba
 
 
 # scalers
-_scaler_standard = lambda x: (x - x.mean()) / x.std(ddof=0)
-_scaler_relative_proba = lambda x: x / x.sum()
+# レースごとの平均などをgroupby.transformでまとめて計算し、レース単位のPythonの処理をなくす
+def _scaler_standard(score: pd.Series) -> pd.Series:
+    grouped = score.groupby(level=0, sort=False)
+    return (score - grouped.transform('mean')) / grouped.transform('std', ddof=0)
+
+def _scaler_relative_proba(score: pd.Series) -> pd.Series:
+    return score / score.groupby(level=0, sort=False).transform('sum')
 
 
 # policies
@@ -49,7 +62,7 @@ class StdScorePolicy(AbstractScorePolicy):
     def calc(model, X: pd.DataFrame) -> pd.DataFrame:
         score_table = _calc(model, X)
         # レース内でスコアを標準化
-        score_table[_SCORE] = _apply_scaler(score_table[_SCORE], _scaler_standard)
+        score_table[_SCORE] = _scaler_standard(score_table[_SCORE])
         return score_table
 
 class MinMaxScorePolicy(AbstractScorePolicy):
@@ -60,7 +73,7 @@ class MinMaxScorePolicy(AbstractScorePolicy):
     def calc(model, X: pd.DataFrame) -> pd.DataFrame:
         score_table = _calc(model, X)
         # レース内でスコアを標準化
-        score = _apply_scaler(score_table[_SCORE], _scaler_standard)
+        score = _scaler_standard(score_table[_SCORE])
         # データ全体で0~1にスケーリング
         min_ = score.min()
         score_table[_SCORE] = (score - min_) / (score.max() - min_)
@@ -74,5 +87,17 @@ class RelativeProbaScorePolicy(AbstractScorePolicy):
     def calc(model, X: pd.DataFrame) -> pd.DataFrame:
         score_table = _calc(model, X)
         # レース内でスコアを相対確率化
-        score_table[_SCORE] = _apply_scaler(score_table[_SCORE], _scaler_relative_proba)
+        score_table[_SCORE] = _scaler_relative_proba(score_table[_SCORE])
         return score_table
+
+
+def calc_all_scores(
+    model,
+    X: pd.DataFrame,
+    policies: list = [BasicScorePolicy, StdScorePolicy, MinMaxScorePolicy, RelativeProbaScorePolicy]
+    ) -> dict:
+    """
+    predict_probaを1回だけ呼び、policiesの各スコアテーブルを計算する。キーはpolicyのクラス名。
+    """
+    precomputed = _PrecomputedModel(model.predict_proba(X))
+    return {policy.__name__: policy.calc(precomputed, X) for policy in policies}
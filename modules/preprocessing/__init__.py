@@ -1,7 +1,16 @@
 from ._horse_results_processor import HorseResultsProcessor
 from ._horse_info_processor import HorseInfoProcessor
+from ._horse_results_aggregator import HorseResultsAggregator
+from ._horse_results_snapshot import HorseResultsSnapshot
+from ._pedigree_index import PedigreeIndex
+from ._pedigree_aggregator import PedigreeAggregator
+from ._person_results_aggregator import PersonResultsAggregator
+from ._feature_spec import FeatureSpec
 from ._data_merger import DataMerger
+from ._dtype_optimizer import DtypeOptimizer
+from ._id_master import IdMaster
 from ._feature_engineering import FeatureEngineering
+from ._feature_store import FeatureStore, FeatureStoreQuery
 from ._peds_processor import PedsProcessor
 from ._race_info_processor import RaceInfoProcessor
 from ._results_processor import ResultsProcessor
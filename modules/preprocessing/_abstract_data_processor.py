@@ -3,15 +3,23 @@ from abc import ABCMeta, abstractmethod
 
 class AbstractDataProcessor(metaclass=ABCMeta):
     def __init__(self, filepath: str):
-        self.__raw_data = pd.read_pickle(filepath)
+        self.__filepath = filepath
+        # rawデータは、_preprocessで初めて使う時に読み込む
+        self.__raw_data = None
         self.__preprocessed_data = self._preprocess()
 
     @abstractmethod
     def _preprocess(self):
         pass
     
+    @property
+    def filepath(self) -> str:
+        return self.__filepath
+
     @property
     def raw_data(self):
+        if self.__raw_data is None:
+            self.__raw_data = pd.read_pickle(self.__filepath)
         return self.__raw_data.copy()
 
     @property
@@ -1,10 +1,15 @@
+import os
 import pandas as pd
 from ._horse_results_processor import HorseResultsProcessor
 from ._horse_info_processor import HorseInfoProcessor
 from ._peds_processor import PedsProcessor
 from ._race_info_processor import RaceInfoProcessor
 from ._results_processor import ResultsProcessor
-from tqdm.auto import tqdm
+from ._horse_results_aggregator import HorseResultsAggregator
+from ._pedigree_aggregator import PedigreeAggregator
+from ._person_results_aggregator import PersonResultsAggregator
+from ._feature_spec import FeatureSpec
+from modules.constants import LocalPaths
 
 class DataMerger:
     def __init__(
@@ -16,9 +21,15 @@ class DataMerger:
         peds_processor: PedsProcessor,
         target_cols: list,
         group_cols: list,
+        pedigree_aggregator: PedigreeAggregator = None,
+        person_results_aggregator: PersonResultsAggregator = None,
+        feature_spec: FeatureSpec = None,
         ):
         """
         初期処理
+        pedigree_aggregatorを渡した場合、父・母父などの産駒成績の集計もマージする。
+        person_results_aggregatorを渡した場合、騎手・調教師・馬主の成績の集計もマージする。
+        feature_specを渡した場合、そこにない集計値・血統の列は計算・マージしない。
         """
         # レース結果テーブル（前処理後）
         self._results = results_processor.preprocessed_data
@@ -36,19 +47,69 @@ class DataMerger:
         self._target_cols = target_cols
         # horse_idと一緒にターゲットエンコーディングしたいカテゴリ変数
         self._group_cols = group_cols
+        # 産駒成績の集計器
+        self._pedigree_aggregator = pedigree_aggregator
+        # 騎手・調教師・馬主の成績の集計器
+        self._person_results_aggregator = person_results_aggregator
+        # 特徴量選択で残した特徴量の一覧
+        self._feature_spec = feature_spec
         # 全てのマージが完了したデータ
         self._merged_data = pd.DataFrame()
-        # 日付(date列)ごとに分かれたレース結果
-        self._separated_results_dict = {}
-        # レース結果データのdateごとに分かれた馬の過去成績
-        self._separated_horse_results_dict = {}
     
-    def merge(self):
+    def merge(self, n_jobs: int = 1):
         """
-        マージ処理
+        マージ処理。n_jobsに2以上(-1で全コア)を指定すると、過去成績の集計を並列に行う。
         """
         self._merge_race_info()
-        self._merge_horse_results()
+        self._merge_horse_results(n_jobs=n_jobs)
+        self._merge_pedigree_results()
+        self._merge_person_results()
+        self._merge_horse_info()
+        self._merge_peds()
+    
+    def update(self, filepath: str = LocalPaths.MERGED_HORSE_RESULTS_PATH, n_jobs: int = 1):
+        """
+        差分マージ処理。
+        filepathに保存された「馬の過去成績の集計まで済んだデータ」を読み込み、
+        その最終日（ウォーターマーク）以降の日付のレースだけを集計して追加する。
+        ウォーターマーク当日のレースは前回の更新後に取得されたものがありうるので、集計し直して置き換える。
+        追加後のデータはfilepathに保存し直す。ファイルが存在しない場合は全件を集計する。
+        馬の基本情報・血統テーブルは軽いので、毎回全件にマージし直す。
+        """
+        results, race_info = self._results, self._race_info
+        if os.path.isfile(filepath):
+            stored = pd.read_pickle(filepath)
+            watermark = stored['date'].max()
+            # ウォーターマーク以降の日付のレースに絞る
+            new_race_info = race_info[race_info['date'] >= watermark]
+            new_results = results[results.index.isin(new_race_info.index)]
+        else:
+            stored = pd.DataFrame()
+            new_race_info, new_results = race_info, results
+        print('{} new races'.format(new_results.index.nunique()))
+        # 集計は絞り込んだレースだけで行い、後のmergeなどのために元のテーブルに戻す
+        self._results, self._race_info = new_results, new_race_info
+        try:
+            self._merge_race_info()
+            self._merge_horse_results(n_jobs=n_jobs)
+            self._merge_pedigree_results()
+            self._merge_person_results()
+        finally:
+            self._results, self._race_info = results, race_info
+        if len(self._merged_data) == 0:
+            self._merged_data = stored
+        elif len(stored) > 0:
+            # target_cols, group_colsなどの集計条件が変わった場合は、全件を集計し直す必要がある
+            if list(self._merged_data.columns) != list(stored.columns):
+                raise ValueError(
+                    'columns of {} do not match. delete it and merge all data again.'.format(filepath)
+                    )
+            # 集計し直したレースは、保存済みのものを置き換える
+            # 置き換えたレースが末尾に来ないよう、mergeと同じく日付順に並べる
+            stored = stored[~stored.index.isin(self._merged_data.index)]
+            self._merged_data = pd.concat([stored, self._merged_data]).sort_values('date', kind='stable')
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        self._merged_data.to_pickle(filepath)
         self._merge_horse_info()
         self._merge_peds()
     
@@ -63,66 +124,42 @@ class DataMerger:
             how = 'left'
             )
     
-    def _separate_by_date(self):
-        """
-        - レース結果を日付(date列)ごとに分ける
-        - (レース結果のdate, その日に走る馬の過去成績データ)のペアを作る
-        """
-        print('separating horse results by date')
-        # dateでデータを分割
-        for date, df_by_date in tqdm(self._results.groupby('date')):
-            self._separated_results_dict[date] = df_by_date
-            # その日に走る馬一覧
-            horse_id_list = df_by_date['horse_id'].unique()
-            # dateより過去に絞る
-            self._separated_horse_results_dict[date] = self._horse_results\
-                    .query('date < @date').query('index in @horse_id_list')
-
-    def _merge_horse_results(self, n_races_list = [5, 9]):
+    def _merge_horse_results(self, n_races_list = [5, 9], n_jobs = 1):
         """
         馬の過去成績テーブルのマージ
         """
-        self._separate_by_date()
         print('merging horse_results')
-        output_results_dict = {}
-        for date in tqdm(self._separated_results_dict):
-            results = self._separated_results_dict[date].copy()
-            horse_results = self._separated_horse_results_dict[date].copy()
-            # 直近nレースに絞った過去成績をマージ
-            for n_races in n_races_list:
-                # 直近nレースに絞った過去成績
-                n_race_horse_results = self._filter_horse_results(self._separated_horse_results_dict[date], n_races)
-                
-                # horse_idのみのターゲットエンコーディング
-                # 何レース分集計しているか分かるように、列名に接尾辞をつける
-                summarized = self._summarize(n_race_horse_results, self._target_cols).add_suffix('_{}R'.format(n_races))
-                # resultsにマージ
-                results = results.merge(summarized, left_on='horse_id', right_index=True, how='left')
-                
-                # horse_idとカテゴリ変数を合わせてターゲットエンコーディング
-                for group_col in self._group_cols:
-                    # 何レース分、どのカテゴリ変数とともに集計しているか分かるように、列名に接尾辞をつける
-                    summarized_with = self._summarize_with(n_race_horse_results, self._target_cols, group_col)\
-                        .add_suffix('_{}_{}R'.format(group_col, n_races)) 
-                    # resultsにマージ
-                    results = results.merge(summarized_with, left_on=['horse_id', group_col],right_index=True, how='left')
-            # 直近nレースに絞らないで過去成績をマージ
-            summarized = self._summarize(horse_results, self._target_cols).add_suffix('_allR')
-            results = results.merge(summarized, left_on='horse_id', right_index=True, how='left')
-            for group_col in self._group_cols:
-                # どのカテゴリ変数とともに集計しているか分かるように、列名に接尾辞をつける
-                summarized_with = self._summarize_with(horse_results, self._target_cols, group_col)\
-                    .add_suffix('_{}_allR'.format(group_col))
-                # resultsにマージ
-                results = results.merge(summarized_with, left_on=['horse_id', group_col], right_index=True, how='left')
-            # 前走の日付をマージ
-            latest = horse_results.groupby('horse_id')['date'].max().rename('latest')
-            results = results.merge(latest, left_on='horse_id', right_index=True, how='left')
-            # 辞書型に格納
-            output_results_dict[date] = results
-        # 日付で分かれていたものを結合
-        merged_data = pd.concat([output_results_dict[date] for date in output_results_dict])
-        self._merged_data = merged_data
+        # 日付順に並べる。日付が欠損しているレースは除く
+        results = self._results[self._results['date'].notna()].sort_values('date', kind='stable')
+        # 過去成績を一度だけソートし、全レース分の「その日より前の過去成績」をまとめて集計
+        aggregator = HorseResultsAggregator(self._horse_results, self._target_cols, self._group_cols)
+        if n_jobs == 1:
+            summarized = aggregator.transform(results, n_races_list, columns=self._spec_features())
+        else:
+            summarized = aggregator.transform_parallel(
+                results, n_races_list, n_jobs, columns=self._spec_features()
+                )
+        self._merged_data = pd.concat([results, summarized], axis=1)
+    
+    def _merge_pedigree_results(self):
+        """
+        産駒成績の集計のマージ
+        """
+        if self._pedigree_aggregator is None or len(self._merged_data) == 0:
+            return
+        print('merging pedigree results')
+        summarized = self._pedigree_aggregator.transform(self._merged_data, self._spec_features())
+        self._merged_data = pd.concat([self._merged_data, summarized], axis=1)
+    
+    def _merge_person_results(self):
+        """
+        騎手・調教師・馬主の成績の集計のマージ
+        """
+        if self._person_results_aggregator is None or len(self._merged_data) == 0:
+            return
+        print('merging person results')
+        summarized = self._person_results_aggregator.transform(self._merged_data, self._spec_features())
+        self._merged_data = pd.concat([self._merged_data, summarized], axis=1)
     
     def _merge_horse_info(self):
         """
@@ -139,31 +176,26 @@ class DataMerger:
         """
         血統テーブルのマージ
         """
+        peds = self._peds
+        if self._feature_spec is not None:
+            peds = peds[[col for col in peds.columns if self._feature_spec.keeps(col)]]
         self._merged_data = self._merged_data.merge(
-            self._peds,
+            peds,
             left_on='horse_id',
             right_index=True,
             how='left'
             )
     
+    def _spec_features(self) -> list:
+        """
+        集計する列。feature_specがない場合はNone(全て集計する)
+        """
+        return None if self._feature_spec is None else list(self._feature_spec.features)
+
+    @property
+    def feature_spec(self):
+        return self._feature_spec
+
     @property
     def merged_data(self):
         return self._merged_data
-    
-    def _filter_horse_results(self, horse_results, n_races):
-        """
-        直近nレースに絞る
-        """
-        return horse_results.sort_values('date', ascending=False).groupby(level=0).head(n_races)
-    
-    def _summarize(self, horse_results, target_cols):
-        """
-        horse_idごとに、target_colsを集計する
-        """
-        return horse_results.groupby(level=0)[target_cols].mean()
-        
-    def _summarize_with(self, horse_results, target_cols, group_col):
-        """
-        horse_id, group_colごとにtarget_colsを集計する
-        """
-        return horse_results.groupby(['horse_id', group_col])[target_cols].mean()
\ No newline at end of file
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+
+class DtypeOptimizer:
+    """
+    DataMerger.merged_dataやFeatureEngineering.featured_dataのdtypeを、
+    値を表現できる範囲で小さいものに変換してメモリを減らすクラス。
+    - float64 → float32
+    - 整数 → 値の範囲に収まる最小の整数型。0/1のみの列(ダミー変数)はuint8
+    - 文字列の列 → categorize_strings=Trueの場合のみ、値の種類が行数の半分以下ならCategorical型
+    学習時はどのみちfloat32の行列にするので、数値の列の変換は学習結果に影響しない。
+    文字列の列をCategorical型にすると、LightGBMはカテゴリ変数として扱うので学習結果が変わる。
+    """
+    def __init__(self, exclude_cols: list = [], categorize_strings: bool = False, verbose: bool = True):
+        """
+        exclude_colsの列は変換しない。verbose=Trueの場合、削減したメモリ量を表示する。
+        categorize_strings=Trueの場合、文字列の列もCategorical型に変換する。
+        """
+        self.__exclude_cols = exclude_cols
+        self.__categorize_strings = categorize_strings
+        self.__verbose = verbose
+        self.__memory_before = None
+        self.__memory_after = None
+
+    def transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        self.__memory_before = data.memory_usage(deep=True).sum()
+        dtypes = {}
+        for col, dtype in data.dtypes.items():
+            if col in self.__exclude_cols or isinstance(dtype, pd.CategoricalDtype):
+                continue
+            if dtype.kind == 'f' and dtype.itemsize > 4:
+                dtypes[col] = np.float32
+            elif dtype.kind in 'iu':
+                dtypes[col] = self.__int_dtype_of(data[col].to_numpy())
+            elif self.__categorize_strings and dtype.kind == 'O' and data[col].nunique() <= len(data) // 2:
+                dtypes[col] = 'category'
+        # 変換が必要な列がなければコピーしない
+        dtypes = {col: dtype for col, dtype in dtypes.items() if data[col].dtype != dtype}
+        if len(dtypes) > 0:
+            data = data.astype(dtypes)
+        self.__memory_after = data.memory_usage(deep=True).sum()
+        if self.__verbose:
+            print('memory usage: {:.1f}MB -> {:.1f}MB ({:.1%} saved)'.format(
+                self.__memory_before / 1024**2, self.__memory_after / 1024**2, self.saved_ratio
+                ))
+        return data
+
+    @property
+    def memory_before(self):
+        return self.__memory_before
+
+    @property
+    def memory_after(self):
+        return self.__memory_after
+
+    @property
+    def saved_ratio(self):
+        if not self.__memory_before:
+            return 0.0
+        return 1 - self.__memory_after / self.__memory_before
+
+    @staticmethod
+    def __int_dtype_of(values: np.ndarray):
+        """
+        valuesを表現できる最小の整数型
+        """
+        if len(values) == 0:
+            return values.dtype
+        lo, hi = values.min(), values.max()
+        if lo >= 0:
+            # ダミー変数(0/1)もuint8になる
+            for dtype in (np.uint8, np.uint16, np.uint32):
+                if hi <= np.iinfo(dtype).max:
+                    return dtype
+        else:
+            for dtype in (np.int8, np.int16, np.int32):
+                if np.iinfo(dtype).min <= lo and hi <= np.iinfo(dtype).max:
+                    return dtype
+        return values.dtype
@@ -1,108 +1,124 @@
-import os
+import numpy as np
 import pandas as pd
 
 from ._data_merger import DataMerger
-from modules.constants import LocalPaths, HorseResultsCols, Master
+from ._feature_spec import FeatureSpec
+from ._id_master import IdMaster
+from modules.constants import HorseResultsCols, Master
 
 class FeatureEngineering:
     """
     使うテーブルを全てマージした後の処理をするクラス。
     新しい特徴量を作りたいときは、メソッド単位で追加していく。
     各メソッドは依存関係を持たないよう注意。
+    ダミー変数化と列の削除はその場では行わず、featured_dataを取り出す時にまとめて行う。
+    feature_specがある場合は、そこにない特徴量は作らず、featured_dataからも除く。
     """
-    def __init__(self, data_merger: DataMerger):
+    # 特徴量の作り方。学習用データと当日の出馬表データで同じものを使う
+    DEFAULT_STEPS = (
+        'add_interval',
+        'add_agedays',
+        'dumminize_ground_state',
+        'dumminize_race_type',
+        'dumminize_sex',
+        'dumminize_weather',
+        'encode_horse_id',
+        'encode_jockey_id',
+        'encode_trainer_id',
+        'encode_owner_id',
+        'encode_breeder_id',
+        'dumminize_kaisai',
+        'dumminize_around',
+        'dumminize_race_class',
+        )
+
+    def __init__(self, data_merger: DataMerger, feature_spec: FeatureSpec = None):
+        """
+        feature_specを指定しない場合は、data_mergerのものを使う。
+        """
         self.__data = data_merger.merged_data.copy()
+        self.__feature_spec = feature_spec if feature_spec is not None else data_merger.feature_spec
+        # ダミー変数化する列と、そのカテゴリ
+        self.__dummies = {}
+        # 削除する列
+        self.__drop_cols = []
+
     @property
     def featured_data(self):
+        self.__materialize()
+        if self.__feature_spec is not None:
+            self.__data = self.__data[[col for col in self.__data.columns if self.__feature_spec.keeps(col)]]
         return self.__data
+
+    def run(self, steps: tuple = DEFAULT_STEPS):
+        """
+        stepsに並べたメソッドを順に実行する。
+        """
+        for step in steps:
+            getattr(self, step)()
+        return self
     
     def add_interval(self):
         """
         前走からの経過日数
         """
-        self.__data['interval'] = (self.__data['date'] - self.__data['latest']).dt.days
-        self.__data.drop('latest', axis=1, inplace=True)
+        # ダミー変数より後ろに追加される列なので、先にダミー変数を作っておく
+        self.__materialize()
+        if self.__wants('interval'):
+            self.__data['interval'] = (self.__data['date'] - self.__data['latest']).dt.days
+        self.__drop_cols.append('latest')
         return self
 
     def add_agedays(self):
         """
         レース出走日から日齢を算出
         """
+        self.__materialize()
         # 日齢を算出
-        self.__data['age_days'] = (self.__data['date'] - self.__data['birthday']).dt.days
-        self.__data.drop('birthday', axis=1, inplace=True)
+        if self.__wants('age_days'):
+            self.__data['age_days'] = (self.__data['date'] - self.__data['birthday']).dt.days
+        self.__drop_cols.append('birthday')
         return self
     
     def dumminize_weather(self):
         """
         weatherカラムをダミー変数化する
         """
-        self.__data['weather'] = pd.Categorical(self.__data['weather'], Master.WEATHER_LIST)
-        self.__data = pd.get_dummies(self.__data, columns=['weather'])
+        self.__dumminize('weather', Master.WEATHER_LIST)
         return self
     
     def dumminize_race_type(self):
         """
         race_typeカラムをダミー変数化する
         """
-        self.__data['race_type'] = pd.Categorical(
-            self.__data['race_type'], list(Master.RACE_TYPE_DICT.values())
-            )
-        self.__data = pd.get_dummies(self.__data, columns=['race_type'])
+        self.__dumminize('race_type', list(Master.RACE_TYPE_DICT.values()))
         return self
     
     def dumminize_ground_state(self):
         """
         ground_stateカラムをダミー変数化する
         """
-        self.__data['ground_state'] = pd.Categorical(
-            self.__data['ground_state'], Master.GROUND_STATE_LIST
-            )
-        self.__data = pd.get_dummies(self.__data, columns=['ground_state'])
+        self.__dumminize('ground_state', Master.GROUND_STATE_LIST)
         return self
     
     def dumminize_sex(self):
         """
         sexカラムをダミー変数化する
         """
-        self.__data['性'] = pd.Categorical(self.__data['性'], Master.SEX_LIST)
-        self.__data = pd.get_dummies(self.__data, columns=['性'])
+        self.__dumminize('性', Master.SEX_LIST)
         return self
     
     def __label_encode(self, target_col: str):
         """
         引数で指定されたID（horse_id/jockey_id/trainer_id/owner_id/breeder_id）を
         ラベルエンコーディングして、Categorical型に変換する。
+        IDと整数の対応表はIdMasterに保存され、新しいIDには続きの番号が振られる。
         """
-        csv_path = os.path.join(LocalPaths.MASTER_DIR, target_col + '.csv')
-        # ファイルが存在しない場合、空のDataFrameを作成
-        if not os.path.isfile(csv_path):
-            target_master = pd.DataFrame(columns=[target_col, 'encoded_id'])
-        else:
-            target_master = pd.read_csv(csv_path, dtype=object)
-
-        # 後のmaxでエラーになるので、整数に変換
-        target_master['encoded_id'] = target_master['encoded_id'].astype(int)
-
-        # masterに存在しない、新しい情報を抽出
-        new_target = self.__data[[target_col]][
-            ~self.__data[target_col].isin(target_master[target_col])
-            ].drop_duplicates(subset=[target_col])
-        # 新しい情報を登録
-        if len(target_master) > 0:
-            new_target['encoded_id'] = [
-                i+max(target_master['encoded_id']) for i in range(1, len(new_target)+1)
-                ]
-            # 整数に変換
-            new_target['encoded_id'] = new_target['encoded_id'].astype(int)
-        else: # まだ1行も登録されていない場合の処理
-            new_target['encoded_id'] = [i for i in range(len(new_target))]
-        # 元のマスタと繋げる
-        new_target_master = pd.concat([target_master, new_target]).set_index(target_col)['encoded_id']
-        # マスタファイルを更新
-        new_target_master.to_csv(csv_path)
-        # ラベルエンコーディング実行
-        self.__data[target_col] = pd.Categorical(self.__data[target_col].map(new_target_master))
+        if not self.__wants(target_col):
+            self.__drop_cols.append(target_col)
+            return self
+        encoded = IdMaster().encode(target_col, self.__data[target_col])
+        self.__data[target_col] = pd.Categorical(encoded)
         return self
     
     def encode_horse_id(self):
@@ -144,24 +160,57 @@ class FeatureEngineering:
         """
         開催カラムをダミー変数化する
         """
-        self.__data[HorseResultsCols.PLACE] = pd.Categorical(
-            self.__data[HorseResultsCols.PLACE], list(Master.PLACE_DICT.values())
-            )
-        self.__data = pd.get_dummies(self.__data, columns=[HorseResultsCols.PLACE])
+        self.__dumminize(HorseResultsCols.PLACE, list(Master.PLACE_DICT.values()))
         return self
 
     def dumminize_around(self):
         """
         aroundカラムをダミー変数化する
         """
-        self.__data['around'] = pd.Categorical(self.__data['around'], Master.AROUND_LIST)
-        self.__data = pd.get_dummies(self.__data, columns=['around'])
+        self.__dumminize('around', Master.AROUND_LIST)
         return self
 
     def dumminize_race_class(self):
         """
         race_classカラムをダミー変数化する
         """
-        self.__data['race_class'] = pd.Categorical(self.__data['race_class'], Master.RACE_CLASS_LIST)
-        self.__data = pd.get_dummies(self.__data, columns=['race_class'])
-        return self
\ No newline at end of file
+        self.__dumminize('race_class', Master.RACE_CLASS_LIST)
+        return self
+
+    def __dumminize(self, col: str, categories):
+        """
+        colをcategoriesでダミー変数化する列として登録する。
+        feature_specにないダミー変数は作らない。
+        """
+        self.__dummies[col] = [
+            category for category in categories if self.__wants('{}_{}'.format(col, category))
+            ]
+
+    def __wants(self, col: str) -> bool:
+        """
+        colの特徴量を作る必要があるか
+        """
+        return self.__feature_spec is None or self.__feature_spec.keeps(col)
+
+    def __materialize(self):
+        """
+        登録されたダミー変数化と列の削除を、まとめて一度に行う。
+        ダミー変数は全ての列を一つのbool型の配列に書き込んでから結合するので、
+        pd.get_dummiesを列ごとに呼んで表全体をコピーし直すことがない。
+        列の並びはpd.get_dummiesを順に呼んだ場合と同じ。
+        """
+        if len(self.__dummies) == 0 and len(self.__drop_cols) == 0:
+            return
+        rest = self.__data.drop(self.__drop_cols + list(self.__dummies), axis=1)
+        block = np.zeros((len(rest), sum(len(c) for c in self.__dummies.values())), dtype=bool)
+        rows = np.arange(len(rest))
+        columns = []
+        for col, categories in self.__dummies.items():
+            codes = pd.Categorical(self.__data[col], categories).codes
+            hit = codes >= 0
+            block[rows[hit], len(columns) + codes[hit]] = True
+            columns += ['{}_{}'.format(col, category) for category in categories]
+        dummies = pd.DataFrame(block, index=rest.index, columns=columns)
+        self.__data = pd.concat([rest, dummies], axis=1, copy=False)
+        self.__dummies = {}
+        self.__drop_cols = []
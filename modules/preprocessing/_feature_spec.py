@@ -0,0 +1,33 @@
+import dataclasses
+import json
+import os
+
+from modules.constants import LocalPaths, ResultsCols
+
+
+@dataclasses.dataclass(frozen=True)
+class FeatureSpec:
+    """
+    モデルに使う特徴量の一覧。FeatureSelectorで作り、DataMerger・FeatureEngineeringに渡すと、
+    一覧にない集計値・ダミー変数などを計算しなくなる。
+    keep_colsは、特徴量ではないが学習・シミュレーションに必要な列。
+    """
+    features: tuple
+    keep_cols: tuple = ('rank', 'date', ResultsCols.TANSHO_ODDS)
+
+    def keeps(self, col: str) -> bool:
+        return col in self.features or col in self.keep_cols
+
+    def save(self, filepath: str = LocalPaths.FEATURE_SPEC_PATH):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(
+                {'features': list(self.features), 'keep_cols': list(self.keep_cols)},
+                f, ensure_ascii=False, indent=2
+                )
+
+    @staticmethod
+    def load(filepath: str = LocalPaths.FEATURE_SPEC_PATH) -> 'FeatureSpec':
+        with open(filepath, encoding='utf-8') as f:
+            spec = json.load(f)
+        return FeatureSpec(tuple(spec['features']), tuple(spec['keep_cols']))
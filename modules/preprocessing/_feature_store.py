@@ -0,0 +1,251 @@
+import dataclasses
+import datetime
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from modules.constants import LocalPaths
+
+
+class FeatureStore:
+    """
+    FeatureEngineering.featured_dataを、バージョンごと・レース月ごとに分けて保存するクラス。
+    保存先は(store_dir)/(version)/(yyyymm)/で、期間と列を指定して読み込む時は、
+    必要な月の、必要な列の部分だけを読む。
+    列名やdtypeなどのスキーマは(store_dir)/(version)/manifest.jsonに記録する。
+    """
+    def __init__(self, store_dir: str = LocalPaths.FEATURE_STORE_DIR):
+        self.__store_dir = store_dir
+
+    @property
+    def versions(self) -> list:
+        """
+        保存済みのバージョンの一覧
+        """
+        if not os.path.isdir(self.__store_dir):
+            return []
+        return sorted(
+            version for version in os.listdir(self.__store_dir)
+            if os.path.isfile(self.__manifest_path(version))
+            )
+
+    def manifest(self, version: str) -> dict:
+        with open(self.__manifest_path(version), encoding='utf-8') as f:
+            return json.load(f)
+
+    def write(self, featured_data: pd.DataFrame, version: str):
+        """
+        featured_dataをversionとして保存する。
+        既に同じversionがある場合、featured_dataに含まれる月のデータは丸ごと置き換え、
+        それ以外の月はそのまま残す。列の構成が保存済みのものと違う場合はエラー。
+        """
+        if featured_data['date'].isna().any():
+            raise ValueError('featured_data has rows without date')
+        columns = featured_data.columns.tolist()
+        if os.path.isfile(self.__manifest_path(version)):
+            manifest = self.manifest(version)
+            dtypes = {col: str(dtype) for col, dtype in featured_data.dtypes.items()}
+            if manifest['columns'] != columns or manifest['dtypes'] != dtypes:
+                raise ValueError('columns do not match the stored version {}'.format(version))
+        else:
+            manifest = {
+                'version': version,
+                'columns': columns,
+                'dtypes': {col: str(dtype) for col, dtype in featured_data.dtypes.items()},
+                'index_name': featured_data.index.name,
+                'layout': self.__layout_of(featured_data),
+                'partitions': {},
+                }
+
+        months = featured_data['date'].dt.strftime('%Y%m')
+        for month, data in featured_data.groupby(months, sort=True):
+            self.__write_partition(version, month, data, manifest['layout'])
+            manifest['partitions'][month] = len(data)
+        manifest['partitions'] = dict(sorted(manifest['partitions'].items()))
+        manifest['updated_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+        # 書き込み途中のmanifestを読まれないよう、一時ファイルから置き換える
+        tmp_path = self.__manifest_path(version) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.__manifest_path(version))
+
+    def read(
+        self,
+        version: str,
+        start_date: str = None,
+        end_date: str = None,
+        columns: list = None
+        ) -> pd.DataFrame:
+        """
+        versionのデータのうち、start_date〜end_date(両端を含む)のレースを、columnsの列だけ読み込む。
+        指定しない場合は全期間・全列。
+        """
+        manifest = self.manifest(version)
+        if columns is None:
+            columns = manifest['columns']
+        unknown = [col for col in columns if col not in manifest['columns']]
+        if len(unknown) > 0:
+            raise ValueError('columns not in version {}: {}'.format(version, unknown))
+        start_date = pd.Timestamp(start_date) if start_date is not None else None
+        end_date = pd.Timestamp(end_date) if end_date is not None else None
+
+        # 期間に掛かる月だけを読み込む
+        months = [
+            month for month in manifest['partitions']
+            if (start_date is None or month >= start_date.strftime('%Y%m'))
+            and (end_date is None or month <= end_date.strftime('%Y%m'))
+            ]
+        blocks = self.__blocks({col: manifest['layout'][col] for col in columns})
+        if len(months) == 0:
+            return pd.DataFrame(columns=columns).astype({col: manifest['dtypes'][col] for col in columns})
+
+        # ブロックごとに全ての月を読んでから結合し、DataFrameは最後に一度だけ作る
+        indexes = []
+        parts = {block: [] for block in blocks}
+        categories = []
+        for month in months:
+            partition_dir = self.__partition_dir(version, month)
+            index = pd.read_pickle(os.path.join(partition_dir, 'index.pickle'))
+            mask = np.ones(len(index), dtype=bool)
+            if start_date is not None or end_date is not None:
+                dates = self.__read_block(partition_dir, manifest['layout'], ['date'])[0]
+                if start_date is not None:
+                    mask &= dates >= start_date.to_datetime64()
+                if end_date is not None:
+                    mask &= dates <= end_date.to_datetime64()
+            indexes.append(index[mask])
+            for block, cols in blocks.items():
+                if block == 'other':
+                    other = pd.read_pickle(os.path.join(partition_dir, 'other.pickle'))
+                    parts[block].append(other.loc[mask, cols])
+                else:
+                    parts[block].append(self.__read_block(partition_dir, manifest['layout'], cols)[:, mask])
+            if 'category' in blocks:
+                categories.append(pd.read_pickle(os.path.join(partition_dir, 'categories.pickle')))
+
+        frames = []
+        for block, cols in blocks.items():
+            if block == 'other':
+                frames.append(pd.concat(parts[block], ignore_index=True))
+            elif block == 'category':
+                codes = np.concatenate(parts[block], axis=1)
+                frames.append(pd.DataFrame({
+                    col: self.__concat_categorical(codes[i], [c[col] for c in categories], parts[block])
+                    for i, col in enumerate(cols)
+                    }))
+            else:
+                frames.append(pd.DataFrame(np.concatenate(parts[block], axis=1).T, columns=cols))
+        data = pd.concat(frames, axis=1)[columns]
+        data.index = indexes[0].append(indexes[1:])
+        return data
+
+    def __write_partition(self, version: str, month: str, data: pd.DataFrame, layout: dict):
+        """
+        一か月分のデータを保存する。数値・bool・日付型の列はdtypeごとに一つの配列にまとめ、
+        列ごとに連続したメモリ配置で(block).npyに保存する。Categorical型の列はコードを
+        category.npyに、カテゴリをcategories.pickleに保存する。それ以外の列はother.pickleに保存する。
+        """
+        partition_dir = self.__partition_dir(version, month)
+        tmp_dir = partition_dir + '.tmp'
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        pd.to_pickle(data.index, os.path.join(tmp_dir, 'index.pickle'))
+        for block, cols in self.__blocks(layout).items():
+            if block == 'other':
+                pd.to_pickle(data[cols].reset_index(drop=True), os.path.join(tmp_dir, 'other.pickle'))
+            elif block == 'category':
+                codes = np.stack([data[col].cat.codes.to_numpy(dtype=np.int32) for col in cols])
+                np.save(os.path.join(tmp_dir, 'category.npy'), codes)
+                pd.to_pickle(
+                    {col: data[col].cat.categories for col in cols}, os.path.join(tmp_dir, 'categories.pickle')
+                    )
+            else:
+                np.save(os.path.join(tmp_dir, block + '.npy'), data[cols].to_numpy(dtype=block).T.copy())
+        if os.path.isdir(partition_dir):
+            shutil.rmtree(partition_dir)
+        os.rename(tmp_dir, partition_dir)
+
+    @staticmethod
+    def __read_block(partition_dir: str, layout: dict, cols: list) -> np.ndarray:
+        """
+        同じブロックに保存された列を読み込む。メモリマップで開くので、読み込むのは指定した列の部分だけ。
+        """
+        array = np.load(os.path.join(partition_dir, layout[cols[0]][0] + '.npy'), mmap_mode='r')
+        return np.array(array[[layout[col][1] for col in cols]])
+
+    @staticmethod
+    def __concat_categorical(codes: np.ndarray, categories_list: list, parts: list) -> pd.Categorical:
+        """
+        月ごとのコードを結合してCategorical型に戻す。
+        月ごとにカテゴリが異なる場合は、全ての月のカテゴリを合わせたものでコードを振り直す。
+        """
+        categories = categories_list[0]
+        if all(c.equals(categories) for c in categories_list[1:]):
+            return pd.Categorical.from_codes(codes, categories)
+        categories = categories.append(categories_list[1:]).unique().sort_values()
+        recoded = []
+        start = 0
+        for c, part in zip(categories_list, parts):
+            # 末尾の-1は欠損値のコード(-1)の変換先
+            mapping = np.append(categories.get_indexer(c), -1)
+            recoded.append(mapping[codes[start:start + part.shape[1]]])
+            start += part.shape[1]
+        return pd.Categorical.from_codes(np.concatenate(recoded), categories)
+
+    @staticmethod
+    def __layout_of(featured_data: pd.DataFrame) -> dict:
+        """
+        各列を、どのブロックの何番目に保存するか決める
+        """
+        layout = {}
+        counts = {}
+        for col, dtype in featured_data.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                block = 'category'
+            elif isinstance(dtype, np.dtype) and dtype.kind in 'biufM':
+                block = str(dtype)
+            else:
+                block = 'other'
+            layout[col] = [block, counts.get(block, 0)]
+            counts[block] = counts.get(block, 0) + 1
+        return layout
+
+    @staticmethod
+    def __blocks(layout: dict) -> dict:
+        """
+        ブロックごとの列のリスト。並びはブロック内の位置順。
+        """
+        blocks = {}
+        for col, (block, _) in sorted(layout.items(), key=lambda item: tuple(item[1])):
+            blocks.setdefault(block, []).append(col)
+        return blocks
+
+    def __partition_dir(self, version: str, month: str) -> str:
+        return os.path.join(self.__store_dir, version, month)
+
+    def __manifest_path(self, version: str) -> str:
+        return os.path.join(self.__store_dir, version, 'manifest.json')
+
+
+@dataclasses.dataclass(frozen=True)
+class FeatureStoreQuery:
+    """
+    FeatureStoreから読み込むデータの指定。KeibaAIFactory.createにそのまま渡せる。
+    """
+    version: str
+    start_date: str = None
+    end_date: str = None
+    columns: list = None
+    store_dir: str = LocalPaths.FEATURE_STORE_DIR
+
+    def read(self, required_cols: list = []) -> pd.DataFrame:
+        """
+        columnsを指定している場合は、required_colsも合わせて読み込む。
+        """
+        columns = self.columns
+        if columns is not None:
+            columns = [col for col in required_cols if col not in columns] + list(columns)
+        return FeatureStore(self.store_dir).read(self.version, self.start_date, self.end_date, columns)
@@ -0,0 +1,228 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from tqdm.auto import tqdm
+
+
+# 並列処理時に、各プロセスが読み取り専用で共有する集計器
+_shared_aggregator = None
+
+def _init_worker(aggregator):
+    global _shared_aggregator
+    _shared_aggregator = aggregator
+
+def _transform_chunk(args):
+    results, n_races_list, n_days_list, columns = args
+    return _shared_aggregator.transform(results, n_races_list, n_days_list, columns)
+
+
+class HorseResultsAggregator:
+    """
+    馬の過去成績を、各レースの日付時点で集計するクラス。
+    過去成績をhorse_id・日付の順に一度だけソートしておき、累積和の差分を取ることで
+    「そのレースより前の直近nレース」の平均値を、全レース分まとめて計算する。
+    """
+    def __init__(self, horse_results: pd.DataFrame, target_cols: list, group_cols: list):
+        """
+        初期処理
+        """
+        # 日付のない過去成績は集計対象外
+        horse_results = horse_results[horse_results['date'].notna()]
+        # 集計対象列
+        self.__target_cols = target_cols
+        # horse_idと一緒に集計するカテゴリ変数
+        self.__group_cols = group_cols
+
+        # horse_idを整数コードに変換し、horse_id→日付の順にソート
+        horse_codes, self.__horse_index = pd.factorize(horse_results.index)
+        days = self.__to_days(horse_results['date'])
+        order = np.lexsort((days, horse_codes))
+        horse_codes = horse_codes[order]
+        days = days[order]
+        n_rows = len(order)
+
+        # 各馬の過去成績が始まる位置
+        self.__block_start = np.searchsorted(horse_codes, np.arange(len(self.__horse_index) + 1))
+        # (horse_id, 日付)を一つの整数にまとめた検索用キー
+        self.__min_day = days.min() if n_rows > 0 else 0
+        self.__span = days.max() - self.__min_day + 2 if n_rows > 0 else 1
+        self.__keys = horse_codes * self.__span + (days - self.__min_day)
+        # 前走の日付を取り出すための配列。末尾は範囲外参照用の番兵
+        self.__dates = np.append(horse_results['date'].values[order], np.datetime64('NaT'))
+
+        # 集計対象の値と、欠損していない件数
+        values = horse_results[target_cols].to_numpy(dtype=float)[order]
+        notnull = ~np.isnan(values)
+        values = np.where(notnull, values, 0)
+        self.__cumsum, self.__excl_cumsum = self.__blockwise_cumsum(values, horse_codes)
+        self.__cumcount = self.__cumcount_of(notnull)
+
+        # horse_idとカテゴリ変数の組ごとの累積和
+        # (カテゴリ変数, horse_id・日付順の位置)でソートしておけば、ある馬の期間内で
+        # カテゴリ変数が一致するレースは連続した区間になる
+        self.__group_tables = {}
+        for group_col in group_cols:
+            group_codes, group_index = pd.factorize(horse_results[group_col].values[order])
+            group_order = np.argsort(group_codes, kind='stable')
+            group_codes = group_codes[group_order]
+            cumsum, excl_cumsum = self.__blockwise_cumsum(
+                values[group_order], group_codes * len(self.__horse_index) + horse_codes[group_order]
+                )
+            self.__group_tables[group_col] = {
+                'index': pd.Index(group_index),
+                'keys': group_codes * (n_rows + 1) + group_order,
+                'cumsum': cumsum,
+                'excl_cumsum': excl_cumsum,
+                'cumcount': self.__cumcount_of(notnull[group_order]),
+                }
+
+    def transform(
+        self, results: pd.DataFrame, n_races_list: list, n_days_list: list = [], columns: list = None
+        ) -> pd.DataFrame:
+        """
+        resultsの各行について、そのレースの日付より前の過去成績を集計する。
+        n_races_listは直近nレース、n_days_listは直近n日間(接尾辞は(n)D)の集計。
+        列の並びはDataMerger._merge_horse_resultsの出力と同じ。
+        columnsを指定した場合は、その列だけを集計する(latestは常に出力する)。
+        """
+        horse_codes = self.__horse_index.get_indexer(results['horse_id'])
+        found = horse_codes >= 0
+        horse_codes = np.where(found, horse_codes, 0)
+        # 各馬の過去成績のうち、レース当日より前の区間[start, end)
+        start = self.__block_start[horse_codes]
+        days = self.__to_days(results['date']) - self.__min_day
+        end = self.__search(horse_codes, days, found, start)
+
+        # 前走の日付
+        latest = pd.DataFrame(
+            {'latest': np.where(end > start, self.__dates[end - 1], np.datetime64('NaT'))},
+            index=results.index
+            )
+        # 直近nレースに絞った区間と、絞らない区間
+        windows = [(np.maximum(start, end - n_races), '{}R'.format(n_races)) for n_races in n_races_list]
+        # 直近n日間に絞った区間
+        windows += [
+            (self.__search(horse_codes, days - n_days, found, start), '{}D'.format(n_days))
+            for n_days in n_days_list
+            ]
+        windows.append((start, 'allR'))
+
+        summarized = []
+        for lo, suffix in windows:
+            # horse_idのみの集計
+            target_idx = self.__target_idx(columns, None, suffix)
+            if len(target_idx) > 0:
+                mean = self.__mean(self.__cumsum, self.__excl_cumsum, self.__cumcount, lo, end, target_idx)
+                summarized.append(self.__to_frame(mean, results.index, None, suffix, target_idx))
+            # horse_idとカテゴリ変数を合わせた集計
+            for group_col in self.__group_cols:
+                target_idx = self.__target_idx(columns, group_col, suffix)
+                if len(target_idx) > 0:
+                    mean = self.__summarize_with(results, group_col, lo, end, target_idx)
+                    summarized.append(self.__to_frame(mean, results.index, group_col, suffix, target_idx))
+        return pd.concat(summarized + [latest], axis=1)
+
+    def transform_parallel(
+        self, results: pd.DataFrame, n_races_list: list, n_jobs: int = -1, n_days_list: list = [], columns: list = None
+        ) -> pd.DataFrame:
+        """
+        transformを複数プロセスで並列に実行する。n_jobs=-1の場合はCPUのコア数。
+        各行の集計は互いに独立しているので、resultsを行の順番のまま分割して各プロセスに渡し、
+        結果を同じ順番で結合する。集計器は各プロセスの起動時に一度だけ渡す。
+        """
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if n_jobs == 1 or len(results) < n_jobs:
+            return self.transform(results, n_races_list, n_days_list, columns)
+        bounds = np.linspace(0, len(results), n_jobs * 4 + 1).astype(int)
+        chunks = [(results.iloc[lo:hi], n_races_list, n_days_list, columns) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(self,)) as executor:
+            summarized = list(tqdm(executor.map(_transform_chunk, chunks), total=len(chunks)))
+        return pd.concat(summarized)
+
+    def __search(self, horse_codes: np.ndarray, days: np.ndarray, found: np.ndarray, start: np.ndarray):
+        """
+        各馬の過去成績のうち、(days)日目より前のものが終わる位置
+        """
+        days = np.clip(days, 0, self.__span - 1)
+        return np.where(found, np.searchsorted(self.__keys, horse_codes * self.__span + days), start)
+
+    def __summarize_with(
+        self, results: pd.DataFrame, group_col: str, lo: np.ndarray, hi: np.ndarray, target_idx: np.ndarray
+        ):
+        """
+        区間[lo, hi)の過去成績のうち、resultsのgroup_colと一致するものだけを集計する
+        """
+        table = self.__group_tables[group_col]
+        group_codes = table['index'].get_indexer(results[group_col])
+        n_rows = len(self.__keys) + 1
+        a = np.searchsorted(table['keys'], group_codes * n_rows + lo)
+        b = np.searchsorted(table['keys'], group_codes * n_rows + hi)
+        # カテゴリ変数が欠損・過去に存在しない値の場合は、集計対象なし
+        b = np.where(group_codes >= 0, b, a)
+        return self.__mean(table['cumsum'], table['excl_cumsum'], table['cumcount'], a, b, target_idx)
+
+    def __column_names(self, group_col, suffix: str) -> list:
+        """
+        何レース分、どのカテゴリ変数とともに集計しているか分かるように、列名に接尾辞をつける
+        """
+        if group_col is None:
+            return ['{}_{}'.format(col, suffix) for col in self.__target_cols]
+        return ['{}_{}_{}'.format(col, group_col, suffix) for col in self.__target_cols]
+
+    def __target_idx(self, columns: list, group_col, suffix: str) -> np.ndarray:
+        """
+        集計するtarget_colsの位置。columnsに含まれない列は集計しない
+        """
+        names = self.__column_names(group_col, suffix)
+        if columns is None:
+            return np.arange(len(names))
+        return np.flatnonzero(pd.Index(names).isin(columns))
+
+    def __to_frame(
+        self, mean: np.ndarray, index: pd.Index, group_col, suffix: str, target_idx: np.ndarray
+        ) -> pd.DataFrame:
+        columns = [self.__column_names(group_col, suffix)[i] for i in target_idx]
+        return pd.DataFrame(mean, index=index, columns=columns)
+
+    @staticmethod
+    def __mean(cumsum, excl_cumsum, cumcount, lo, hi, target_idx) -> np.ndarray:
+        """
+        区間[lo, hi)のtarget_idx列の平均値。区間内に値がなければ欠損値。
+        """
+        if len(target_idx) == cumsum.shape[1]:
+            total = cumsum[hi - 1] - excl_cumsum[lo]
+            count = cumcount[hi] - cumcount[lo]
+        else:
+            # 必要な列の要素だけを取り出す
+            total = cumsum[np.ix_(hi - 1, target_idx)] - excl_cumsum[np.ix_(lo, target_idx)]
+            count = cumcount[np.ix_(hi, target_idx)] - cumcount[np.ix_(lo, target_idx)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where((hi > lo)[:, None] & (count > 0), total / count, np.nan)
+
+    @staticmethod
+    def __blockwise_cumsum(values: np.ndarray, block_codes: np.ndarray) -> tuple:
+        """
+        ブロック(同じ馬など)ごとに区切った累積和と、自分自身を含まない累積和。
+        桁落ちを防ぐため、ブロックをまたいで足し込まない。
+        末尾の0行は、区間が空の場合の範囲外参照用の番兵。
+        """
+        cumsum = pd.DataFrame(values).groupby(block_codes, sort=False).cumsum().to_numpy()
+        excl_cumsum = cumsum - values
+        pad = np.zeros((1, values.shape[1]))
+        return np.vstack([cumsum, pad]), np.vstack([excl_cumsum, pad])
+
+    @staticmethod
+    def __cumcount_of(notnull: np.ndarray) -> np.ndarray:
+        """
+        欠損していない値の件数の累積和。先頭に0行をつける。
+        """
+        return np.vstack([np.zeros((1, notnull.shape[1]), dtype=np.int64), notnull.cumsum(axis=0)])
+
+    @staticmethod
+    def __to_days(dates: pd.Series) -> np.ndarray:
+        """
+        日付を日単位の整数に変換
+        """
+        return dates.values.astype('datetime64[D]').astype(np.int64)
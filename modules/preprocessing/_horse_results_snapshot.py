@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pandas as pd
+
+from ._horse_results_aggregator import HorseResultsAggregator
+from ._horse_results_processor import HorseResultsProcessor
+from modules.constants import LocalPaths
+
+
+class HorseResultsSnapshot:
+    """
+    ある時点での、馬ごとの過去成績の集計値を保持するクラス。
+    レース前日までに作成・保存しておき、当日はhorse_idをキーに引くだけで
+    DataMerger._merge_horse_resultsと同じ列を作れるようにする。
+    """
+    def __init__(
+        self,
+        horse_results_processor: HorseResultsProcessor,
+        target_cols: list,
+        group_cols: list,
+        n_races_list: list = [5, 9],
+        horse_id_list: list = None
+        ):
+        """
+        horse_id_listを指定した場合は、その馬だけを集計する（出走予定の馬など）。
+        """
+        horse_results = horse_results_processor.preprocessed_data
+        if horse_id_list is not None:
+            horse_results = horse_results[horse_results.index.isin(horse_id_list)]
+        horse_results = horse_results[horse_results['date'].notna()]
+        aggregator = HorseResultsAggregator(horse_results, target_cols, group_cols)
+        # 集計条件
+        self.__target_cols = target_cols
+        self.__group_cols = group_cols
+        self.__n_races_list = n_races_list
+        # 集計に含まれる過去成績の最終日。これより後のレースにのみ使える
+        self.__latest_date = horse_results['date'].max()
+        # 全ての過去成績より後の日付時点で集計する
+        date = self.__latest_date + pd.Timedelta(days=1)
+        suffixes = self.__suffixes(n_races_list)
+
+        # horse_idのみの集計と前走の日付
+        queries = pd.DataFrame({'horse_id': horse_results.index.unique(), 'date': date})
+        for group_col in group_cols:
+            queries[group_col] = np.nan
+        summarized = aggregator.transform(queries, n_races_list)
+        columns = ['{}_{}'.format(col, suffix) for suffix in suffixes for col in target_cols]
+        self.__horse_table = summarized[columns + ['latest']].set_index(queries['horse_id'])
+
+        # horse_idとカテゴリ変数の組ごとの集計
+        self.__group_tables = {}
+        for group_col in group_cols:
+            queries = horse_results.reset_index()[['horse_id', group_col]]\
+                .dropna().drop_duplicates().reset_index(drop=True)
+            queries['date'] = date
+            for other_col in group_cols:
+                if other_col != group_col:
+                    queries[other_col] = np.nan
+            summarized = aggregator.transform(queries, n_races_list)
+            columns = [
+                '{}_{}_{}'.format(col, group_col, suffix) for suffix in suffixes for col in target_cols
+                ]
+            self.__group_tables[group_col] = summarized[columns]\
+                .set_index(pd.MultiIndex.from_frame(queries[['horse_id', group_col]]))
+
+    def transform(self, results: pd.DataFrame, n_races_list: list) -> pd.DataFrame:
+        """
+        HorseResultsAggregator.transformと同じ列を、集計済みの値を引くことで作る。
+        """
+        if list(n_races_list) != list(self.__n_races_list):
+            raise ValueError('snapshot was created with n_races_list={}'.format(self.__n_races_list))
+        # スナップショット作成後の過去成績は含まれないので、それより前のレースには使えない
+        if (results['date'] <= self.__latest_date).any():
+            raise ValueError('snapshot includes horse_results up to {}'.format(self.__latest_date.date()))
+        summarized = results[['horse_id'] + self.__group_cols].merge(
+            self.__horse_table, left_on='horse_id', right_index=True, how='left'
+            )
+        for group_col in self.__group_cols:
+            summarized = summarized.merge(
+                self.__group_tables[group_col], left_on=['horse_id', group_col], right_index=True, how='left'
+                )
+        # DataMerger._merge_horse_resultsと同じ列の並びにする
+        columns = []
+        for suffix in self.__suffixes(n_races_list):
+            columns += ['{}_{}'.format(col, suffix) for col in self.__target_cols]
+            for group_col in self.__group_cols:
+                columns += ['{}_{}_{}'.format(col, group_col, suffix) for col in self.__target_cols]
+        return summarized[columns + ['latest']]
+
+    def save(self, filepath: str = LocalPaths.HORSE_RESULTS_SNAPSHOT_PATH):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        pd.to_pickle(self, filepath)
+
+    @staticmethod
+    def load(filepath: str = LocalPaths.HORSE_RESULTS_SNAPSHOT_PATH) -> 'HorseResultsSnapshot':
+        return pd.read_pickle(filepath)
+
+    @property
+    def latest_date(self):
+        return self.__latest_date
+
+    @staticmethod
+    def __suffixes(n_races_list: list) -> list:
+        return ['{}R'.format(n_races) for n_races in n_races_list] + ['allR']
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+from contextlib import closing
+import numpy as np
+import pandas as pd
+
+from modules.constants import LocalPaths
+
+
+class IdMaster:
+    """
+    horse_id/jockey_id/trainer_id/owner_id/breeder_idと、ラベルエンコーディング後の
+    整数の対応表をSQLiteで管理するクラス。
+    対応表は追記のみで、一度振った番号は変わらない。
+    複数のプロセスから同時に使っても、書き込みはSQLiteのロックで一つずつ行われる。
+    """
+    def __init__(self, db_path: str = LocalPaths.MASTER_DB_PATH, timeout: float = 60):
+        self.__db_path = db_path
+        # 他のプロセスが書き込み中の場合に待つ秒数
+        self.__timeout = timeout
+
+    def encode(self, target_col: str, ids: pd.Series) -> np.ndarray:
+        """
+        idsを整数に変換する。対応表にないIDには、登録済みの最大値の続きから
+        出現順に番号を振って登録する。
+        """
+        # 欠損値も一つのIDとして扱う（CSVマスタでの運用と同じ）
+        keys = ids.astype(object).where(ids.notna(), '').astype(str)
+        unique_keys = pd.unique(keys)
+        os.makedirs(os.path.dirname(self.__db_path), exist_ok=True)
+        with closing(sqlite3.connect(self.__db_path, timeout=self.__timeout, isolation_level=None)) as conn:
+            # 読み込みから登録までの間に、他のプロセスが番号を振らないようにロックを取る
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS "{}" (id TEXT PRIMARY KEY, encoded_id INTEGER NOT NULL UNIQUE)'
+                    .format(target_col)
+                    )
+                master = self.__read_master(conn, target_col)
+                if len(master) == 0:
+                    master = self.__import_csv(conn, target_col)
+                # masterに存在しない、新しいIDを登録
+                new_keys = unique_keys[~pd.Index(unique_keys).isin(master.index)]
+                if len(new_keys) > 0:
+                    start = master.max() + 1 if len(master) > 0 else 0
+                    new_master = pd.Series(np.arange(start, start + len(new_keys)), index=new_keys)
+                    self.__insert(conn, target_col, new_master)
+                    master = pd.concat([master, new_master])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return master.to_numpy()[master.index.get_indexer(keys)]
+
+    def versions(self) -> dict:
+        """
+        対応表ごとの登録済みIDの数。対応表は追記のみなので、この数が対応表のバージョンになる。
+        """
+        if not os.path.isfile(self.__db_path):
+            return {}
+        with closing(sqlite3.connect(self.__db_path, timeout=self.__timeout)) as conn:
+            tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            return {
+                table: conn.execute('SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0] for table in tables
+                }
+
+    @staticmethod
+    def __read_master(conn, target_col: str) -> pd.Series:
+        """
+        ID→整数の対応表を読み込む
+        """
+        rows = conn.execute('SELECT id, encoded_id FROM "{}"'.format(target_col)).fetchall()
+        return pd.Series(
+            [row[1] for row in rows], index=pd.Index([row[0] for row in rows], dtype=object), dtype=np.int64
+            )
+
+    @staticmethod
+    def __insert(conn, target_col: str, new_master: pd.Series):
+        conn.executemany(
+            'INSERT INTO "{}" (id, encoded_id) VALUES (?, ?)'.format(target_col),
+            zip(new_master.index, new_master.to_numpy().tolist())
+            )
+
+    def __import_csv(self, conn, target_col: str) -> pd.Series:
+        """
+        以前のCSVマスタ（data/master/(target_col).csv）があれば、同じ番号のまま取り込む
+        """
+        csv_path = os.path.join(os.path.dirname(self.__db_path), target_col + '.csv')
+        if not os.path.isfile(csv_path):
+            return pd.Series(dtype=np.int64, index=pd.Index([], dtype=object))
+        target_master = pd.read_csv(csv_path, dtype=object)
+        master = pd.Series(
+            target_master['encoded_id'].astype(np.int64).to_numpy(),
+            index=pd.Index(target_master[target_col].fillna('').astype(str), dtype=object)
+            )
+        self.__insert(conn, target_col, master)
+        return master
@@ -0,0 +1,64 @@
+import pandas as pd
+
+from ._horse_results_aggregator import HorseResultsAggregator
+from ._horse_results_processor import HorseResultsProcessor
+from ._pedigree_index import PedigreeIndex
+from modules.constants import HorseResultsCols as Cols
+
+
+class PedigreeAggregator:
+    """
+    父・母父などの産駒の過去成績を、各レースの日付時点で集計するクラス。
+    過去成績のhorse_idを祖先のIDに置き換えてHorseResultsAggregatorに渡すことで、
+    「そのレースより前の、同じ祖先を持つ馬の全成績」の平均値を全レース分まとめて計算する。
+    """
+    def __init__(
+        self,
+        pedigree_index: PedigreeIndex,
+        horse_results_processor: HorseResultsProcessor,
+        target_cols: list = ['win', Cols.RANK, Cols.PRIZE],
+        group_cols: list = ['race_type', 'course_len'],
+        relations: list = None
+        ):
+        """
+        target_colsの'win'は1着なら1、それ以外は0の列で、平均値が勝率になる。
+        relationsを指定しない場合は、pedigree_indexの全ての関係を集計する。
+        """
+        self.__pedigree_index = pedigree_index
+        self.__group_cols = group_cols
+        self.__relations = pedigree_index.relations if relations is None else relations
+        horse_results = horse_results_processor.preprocessed_data
+        horse_results['win'] = (horse_results[Cols.RANK] == 1).astype(float)
+        self.__aggregators = {}
+        for relation in self.__relations:
+            ancestors = pedigree_index.ancestor_of(relation, horse_results.index)
+            known = pd.notna(ancestors)
+            # 祖先のIDをhorse_idの代わりにする
+            offspring_results = horse_results[known].set_axis(pd.Index(ancestors[known]), axis=0)
+            self.__aggregators[relation] = HorseResultsAggregator(offspring_results, target_cols, group_cols)
+
+    def transform(self, results: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+        """
+        resultsの各行について、そのレースの日付より前の産駒成績を集計する。
+        列名は(relation)_(target_col)と、(relation)_(target_col)_(group_col)。
+        columnsを指定した場合は、その列だけを集計する。
+        """
+        summarized = []
+        for relation in self.__relations:
+            prefix = '{}_'.format(relation)
+            relation_columns = None
+            if columns is not None:
+                relation_columns = [
+                    '{}_allR'.format(col[len(prefix):]) for col in columns if col.startswith(prefix)
+                    ]
+                if len(relation_columns) == 0:
+                    continue
+            queries = results[['date'] + self.__group_cols].copy()
+            queries['horse_id'] = self.__pedigree_index.ancestor_of(relation, results['horse_id'])
+            # 産駒成績は直近nレースに絞らず、全レースを集計する
+            df = self.__aggregators[relation].transform(queries, [], columns=relation_columns).drop('latest', axis=1)
+            df.columns = ['{}{}'.format(prefix, col[:-len('_allR')]) for col in df.columns]
+            summarized.append(df)
+        if len(summarized) == 0:
+            return pd.DataFrame(index=results.index)
+        return pd.concat(summarized, axis=1)
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from ._peds_processor import PedsProcessor
+
+
+class PedigreeIndex:
+    """
+    血統テーブルから、祖先→産駒の対応を配列で持つクラス。
+    祖先ごとの産駒は、CSR形式(indptr, offspring)で連続した区間として引ける。
+    """
+    # 関係名と血統テーブルの列の対応。
+    # peds_0〜peds_61は血統表を上から順に並べたもので、peds_0が父、peds_1が父の父、peds_32が母の父
+    RELATIONS = {
+        'sire': 'peds_0',
+        'sire_sire': 'peds_1',
+        'damsire': 'peds_32',
+        }
+
+    def __init__(self, peds_processor: PedsProcessor, relations: dict = RELATIONS):
+        peds = peds_processor.raw_data
+        self.__horse_index = pd.Index(peds.index)
+        self.__tables = {}
+        for relation, col in relations.items():
+            # 馬→祖先の整数コード。祖先が不明な場合は-1
+            codes, ancestors = pd.factorize(peds[col])
+            # 祖先のコード順に馬を並べ、各祖先の産駒が始まる位置を持っておく
+            order = np.argsort(codes, kind='stable')
+            order = order[codes[order] >= 0]
+            indptr = np.searchsorted(codes[order], np.arange(len(ancestors) + 1))
+            self.__tables[relation] = {
+                'ancestors': pd.Index(ancestors),
+                'codes': codes.astype(np.int32),
+                'indptr': indptr,
+                'offspring': order.astype(np.int32),
+                }
+
+    @property
+    def relations(self) -> list:
+        return list(self.__tables)
+
+    def ancestor_of(self, relation: str, horse_ids) -> np.ndarray:
+        """
+        各馬のrelationにあたる祖先のID。血統が不明な場合は欠損値。
+        """
+        table = self.__tables[relation]
+        positions = self.__horse_index.get_indexer(horse_ids)
+        codes = np.where(positions >= 0, table['codes'][positions], -1)
+        ancestors = np.full(len(codes), np.nan, dtype=object)
+        ancestors[codes >= 0] = table['ancestors'].to_numpy()[codes[codes >= 0]]
+        return ancestors
+
+    def offspring_of(self, relation: str, ancestor_id: str) -> pd.Index:
+        """
+        ancestor_idがrelationにあたる馬のhorse_id
+        """
+        table = self.__tables[relation]
+        code = table['ancestors'].get_indexer([ancestor_id])[0]
+        if code < 0:
+            return self.__horse_index[:0]
+        lo, hi = table['indptr'][code], table['indptr'][code + 1]
+        return self.__horse_index[table['offspring'][lo:hi]]
+
+    def n_offspring(self, relation: str) -> pd.Series:
+        """
+        祖先ごとの産駒の頭数
+        """
+        table = self.__tables[relation]
+        return pd.Series(np.diff(table['indptr']), index=table['ancestors'])
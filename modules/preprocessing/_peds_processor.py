@@ -1,5 +1,7 @@
-from sklearn.preprocessing import LabelEncoder
+import numpy as np
+import pandas as pd
 from ._abstract_data_processor import AbstractDataProcessor
+from ._id_master import IdMaster
 
 
 class PedsProcessor(AbstractDataProcessor):
@@ -15,8 +17,11 @@ class PedsProcessor(AbstractDataProcessor):
     def _preprocess(self):
         df = self.raw_data
 
+        # 全ての列(peds_0〜peds_61)で共通の、祖先IDと整数の対応表を使ってエンコードする。
+        # 対応表はIdMasterに保存されるので、同じ祖先は列が違っても、次に実行した時も同じ番号になる
+        encoded = IdMaster().encode('peds', pd.Series(df.to_numpy().ravel()))
+        encoded = pd.DataFrame(
+            encoded.astype(np.int32).reshape(df.shape), index=df.index, columns=df.columns
+            )
         # カテゴリ変数に型変換を行う
-        for column in df.columns:
-            df[column] = LabelEncoder().fit_transform(df[column].fillna('Na'))
-        return df.astype('category')
- 
\ No newline at end of file
+        return encoded.astype('category')
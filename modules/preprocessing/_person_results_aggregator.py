@@ -0,0 +1,79 @@
+import pandas as pd
+
+from ._horse_results_aggregator import HorseResultsAggregator
+from ._horse_results_processor import HorseResultsProcessor
+from ._race_info_processor import RaceInfoProcessor
+from ._results_processor import ResultsProcessor
+from modules.constants import HorseResultsCols as Cols
+
+
+class PersonResultsAggregator:
+    """
+    騎手・調教師・馬主ごとの成績を、各レースの日付時点で集計するクラス。
+    レース結果テーブルの騎手などのIDに、馬の過去成績テーブルの着順・着差を紐づけ、
+    IDをhorse_idの代わりにしてHorseResultsAggregatorに渡すことで、全レース分まとめて計算する。
+    集計するのはレース当日より前の成績のみなので、同じ日のレースの結果は含まれない。
+    """
+    def __init__(
+        self,
+        results_processor: ResultsProcessor,
+        race_info_processor: RaceInfoProcessor,
+        horse_results_processor: HorseResultsProcessor,
+        person_cols: list = ['jockey_id', 'trainer_id', 'owner_id'],
+        target_cols: list = ['win', 'top3', Cols.RANK_DIFF],
+        group_cols: list = [Cols.PLACE, 'course_len'],
+        n_races_list: list = [100],
+        n_days_list: list = [365]
+        ):
+        """
+        target_colsの'win'は1着、'top3'は3着以内なら1の列で、平均値がそれぞれ勝率・複勝率になる。
+        集計結果の列名は、(person_colから_idを除いたもの)_(target_col)_(group_col)_(n)R/(n)D/allR。
+        """
+        self.__person_cols = person_cols
+        self.__group_cols = group_cols
+        self.__n_races_list = n_races_list
+        self.__n_days_list = n_days_list
+
+        # レース結果テーブルに日付をつけ、馬の過去成績テーブルと(horse_id, 日付)で紐づける
+        results = results_processor.preprocessed_data[['horse_id'] + person_cols]
+        results = results.merge(
+            race_info_processor.preprocessed_data[['date']], left_index=True, right_index=True, how='inner'
+            )
+        horse_results = horse_results_processor.preprocessed_data
+        horse_results['win'] = (horse_results[Cols.RANK] == 1).astype(float)
+        horse_results['top3'] = (horse_results[Cols.RANK] <= 3).astype(float)
+        history = results.merge(
+            horse_results[['date'] + target_cols + group_cols].reset_index(),
+            on=['horse_id', 'date'],
+            how='inner'
+            )
+        self.__aggregators = {}
+        for person_col in person_cols:
+            person_results = history[history[person_col].notna()]
+            self.__aggregators[person_col] = HorseResultsAggregator(
+                person_results.set_index(person_col), target_cols, group_cols
+                )
+
+    def transform(self, results: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+        """
+        resultsの各行について、そのレースの日付より前の、騎手などの成績を集計する。
+        columnsを指定した場合は、その列だけを集計する。
+        """
+        summarized = []
+        for person_col in self.__person_cols:
+            prefix = '{}_'.format(person_col[:-len('_id')] if person_col.endswith('_id') else person_col)
+            person_columns = None
+            if columns is not None:
+                person_columns = [col[len(prefix):] for col in columns if col.startswith(prefix)]
+                if len(person_columns) == 0:
+                    continue
+            queries = results[['date'] + self.__group_cols].copy()
+            queries['horse_id'] = results[person_col]
+            df = self.__aggregators[person_col].transform(
+                queries, self.__n_races_list, self.__n_days_list, person_columns
+                ).drop('latest', axis=1)
+            df.columns = ['{}{}'.format(prefix, col) for col in df.columns]
+            summarized.append(df)
+        if len(summarized) == 0:
+            return pd.DataFrame(index=results.index)
+        return pd.concat(summarized, axis=1)
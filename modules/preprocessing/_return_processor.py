@@ -1,109 +1,191 @@
+import os
+import numpy as np
 import pandas as pd
 from ._abstract_data_processor import AbstractDataProcessor
 
 class ReturnProcessor(AbstractDataProcessor):
-    def __init__(self, filepath):
+    """
+    払い戻し表の前処理。
+    全ての馬券の種類をまとめて1回で解析し、払い戻し1つを1行とする型付きの配列にする。
+    配列はrawデータと同じディレクトリにキャッシュし、rawデータが更新されていなければ
+    次からはrawデータを読まずにキャッシュを使う。
+    """
+    # rawデータの馬券の種類の表記
+    BET_TYPES = {
+        '単勝': 'tansho',
+        '複勝': 'fukusho',
+        '馬連': 'umaren',
+        '馬単': 'umatan',
+        'ワイド': 'wide',
+        '三連単': 'sanrentan',
+        '三連複': 'sanrenpuku',
+        }
+    # 馬券の種類ごとの、1枚の馬券に含まれる馬の数
+    N_HORSES = {
+        'tansho': 1,
+        'fukusho': 1,
+        'umaren': 2,
+        'umatan': 2,
+        'wide': 2,
+        'sanrentan': 3,
+        'sanrenpuku': 3,
+        }
+    # 1レースで読む払い戻しの数の上限。それ以外の馬券は、同着の払い戻しも全て読む
+    MAX_PAYOUTS = {'fukusho': 3, 'wide': 3}
+
+    def __init__(self, filepath, use_cache: bool = True):
         """
         初期処理
+        use_cache=Falseの場合は、キャッシュを使わずにrawデータから作り直す。
         """
+        self.__use_cache = use_cache
         super().__init__(filepath)
-    
+
+    @property
+    def cache_path(self) -> str:
+        """
+        解析済みの配列のキャッシュ。rawデータと同じディレクトリに置く。
+        """
+        return os.path.splitext(self.filepath)[0] + '_payouts.pickle'
+
+    @property
+    def race_index(self) -> pd.Index:
+        """
+        レースの通し番号とrace_idの対応
+        """
+        return self.__race_index
+
+    def payouts(self, bet_type: str) -> dict:
+        """
+        bet_typeの払い戻しの配列。
+        - race: レースの通し番号(race_indexの位置)
+        - position: レース内で何番目の払い戻しか
+        - win: 的中の馬番(着順の順)。解析できなかった場合は0
+        - return: 100円あたりの払戻金。解析できなかった場合は0
+        """
+        return self.__payouts[bet_type]
+
     def _preprocess(self):
         """
         前処理
         """
-        return_dict = {}
-        return_dict['tansho'] = self.__tansho()
-        return_dict['fukusho'] = self.__fukusho()
-        return_dict['umaren'] = self.__umaren()
-        return_dict['umatan'] = self.__umatan()
-        return_dict['wide'] = self.__wide()
-        return_dict['sanrentan'] = self.__sanrentan()
-        return_dict['sanrenpuku'] = self.__sanrenpuku()        
-        return return_dict
-    
-    def __tansho(self):
-        """
-        単勝
-        """
-        tansho = self.raw_data[self.raw_data[0]=='単勝'][[1,2]]
-        tansho.columns = ['win', 'return']
-        
-        for column in tansho.columns:
-            tansho[column] = pd.to_numeric(tansho[column], errors='coerce')
-            
-        return tansho
-    
-    def __fukusho(self):
-        """
-        複勝
-        """
-        fukusho = self.raw_data[self.raw_data[0]=='複勝'][[1,2]]
-        wins = fukusho[1].str.split('br', expand=True)[[0,1,2]]
-        
-        wins.columns = ['win_0', 'win_1', 'win_2']
-        returns = fukusho[2].str.split('br', expand=True)[[0,1,2]]
-        returns.columns = ['return_0', 'return_1', 'return_2']
-        
-        df = pd.concat([wins, returns], axis=1)
-        for column in df.columns:
-            df[column] = df[column].str.replace(',', '')
-        return df.fillna(0).astype(int)
-    
-    
-    def __umaren(self):
-        """
-        馬連
-        """
-        umaren = self.raw_data[self.raw_data[0]=='馬連'][[1,2]]
-        wins = umaren[1].str.split('-', expand=True)[[0,1]].add_prefix('win_')
-        return_ = umaren[2].rename('return')  
-        df = pd.concat([wins, return_], axis=1)        
-        return df.apply(lambda x: pd.to_numeric(x, errors='coerce'))
-    
-    
-    def __umatan(self):
-        """
-        馬単
-        """
-        umatan = self.raw_data[self.raw_data[0]=='馬単'][[1,2]]
-        wins = umatan[1].str.split('→', expand=True)[[0,1]].add_prefix('win_')
-        return_ = umatan[2].rename('return')  
-        df = pd.concat([wins, return_], axis=1)        
-        return df.apply(lambda x: pd.to_numeric(x, errors='coerce'))
-    
-    
-    def __wide(self):
-        """
-        ワイド
-        """
-        wide = self.raw_data[self.raw_data[0]=='ワイド'][[1,2]]
-        wins = wide[1].str.split('br', expand=True)[[0,1,2]]
-        wins = wins.stack().str.split('-', expand=True).add_prefix('win_')
-        return_ = wide[2].str.split('br', expand=True)[[0,1,2]]
-        return_ = return_.stack().rename('return')
-        df = pd.concat([wins, return_], axis=1)
-        return df.apply(lambda x: pd.to_numeric(x.str.replace(',',''), errors='coerce'))
-    
-    
-    def __sanrentan(self):
-        """
-        三連単
-        """
-        rentan = self.raw_data[self.raw_data[0]=='三連単'][[1,2]]
-        wins = rentan[1].str.split('→', expand=True)[[0,1,2]].add_prefix('win_')
-        return_ = rentan[2].rename('return')
-        df = pd.concat([wins, return_], axis=1) 
-        return df.apply(lambda x: pd.to_numeric(x, errors='coerce'))
-    
-    
-    def __sanrenpuku(self):
-        """
-        三連複
-        """
-        renpuku = self.raw_data[self.raw_data[0]=='三連複'][[1,2]]
-        wins = renpuku[1].str.split('-', expand=True)[[0,1,2]].add_prefix('win_')
-        return_ = renpuku[2].rename('return')
-        df = pd.concat([wins, return_], axis=1) 
-        return df.apply(lambda x: pd.to_numeric(x, errors='coerce'))
-    
\ No newline at end of file
+        stat = os.stat(self.filepath)
+        raw_stat = (stat.st_size, stat.st_mtime_ns)
+        cache = None
+        if self.__use_cache and os.path.isfile(self.cache_path):
+            cache = pd.read_pickle(self.cache_path)
+            if cache['raw_stat'] != raw_stat:
+                cache = None
+        if cache is None:
+            race_index, payouts = self.__parse(self.raw_data)
+            cache = {'raw_stat': raw_stat, 'race_index': race_index, 'payouts': payouts}
+            if self.__use_cache:
+                pd.to_pickle(cache, self.cache_path)
+        self.__race_index = cache['race_index']
+        self.__payouts = cache['payouts']
+        return {bet_type: self.__to_frame(bet_type) for bet_type in self.BET_TYPES.values()}
+
+    @classmethod
+    def __parse(cls, raw: pd.DataFrame) -> tuple:
+        """
+        全ての馬券の種類をまとめて、払い戻し1つを1行とする配列にする。
+        1つのセルに複数の払い戻しがある場合(複勝・ワイド・同着)は'br'で区切られている。
+        """
+        raw = raw[raw[0].isin(cls.BET_TYPES.keys())]
+        race_index = pd.Index(raw.index).unique()
+        race = race_index.get_indexer(raw.index).astype(np.int32)
+        bet_types = raw[0].map(cls.BET_TYPES).to_numpy()
+
+        # 払い戻し1つを1行にする。桁区切りのカンマは、全ての馬券の種類についてまとめて1回で除く
+        wins, win_cells = cls.__split(raw[1].astype(str).to_numpy(), 'br')
+        returns, return_cells = cls.__split(raw[2].astype(str).to_numpy(), 'br', remove=',')
+        n_payouts = np.minimum(
+            np.bincount(win_cells, minlength=len(raw)), np.bincount(return_cells, minlength=len(raw))
+            )
+        win_position = cls.__positions(win_cells)
+        return_position = cls.__positions(return_cells)
+        wins = wins[win_position < n_payouts[win_cells]]
+        returns = cls.__to_int(returns[return_position < n_payouts[return_cells]])
+        rows = np.repeat(np.arange(len(raw)), n_payouts)
+        position = cls.__positions(rows)
+
+        # 馬番は'-'(順不同)か'→'(着順通り)で区切られている
+        horses, horse_payouts = cls.__split(wins, '-', remove=' ', replace=('→', '-'))
+        horse_position = cls.__positions(horse_payouts)
+        in_range = horse_position < 3
+        win_table = np.zeros((len(wins), 3), dtype=np.int64)
+        win_table[horse_payouts[in_range], horse_position[in_range]] = cls.__to_int(horses[in_range])
+
+        payout_bet_types = bet_types[rows]
+        payouts = {}
+        for bet_type, n_horses in cls.N_HORSES.items():
+            mask = (payout_bet_types == bet_type) & (position < cls.MAX_PAYOUTS.get(bet_type, np.inf))
+            payouts[bet_type] = {
+                'race': race[rows[mask]],
+                'position': position[mask].astype(np.int8),
+                'win': win_table[mask, :n_horses].astype(np.int8),
+                'return': returns[mask],
+                }
+        return race_index, payouts
+
+    @staticmethod
+    def __split(cells: np.ndarray, sep: str, remove: str = None, replace: tuple = None) -> tuple:
+        """
+        全てのセルを1つの文字列につないでからsepで区切り、(区切った値の配列, 値がどのセルのものか)を返す。
+        セルごとにpandasの文字列処理を呼ぶより速い。セルの境目には改行を値として挟み、その位置からセルの番号を求める。
+        """
+        text = (sep + '\n' + sep).join(cells)
+        if remove is not None:
+            text = text.replace(remove, '')
+        if replace is not None:
+            text = text.replace(*replace)
+        values = np.array(text.split(sep), dtype=object)
+        is_boundary = values == '\n'
+        return values[~is_boundary], np.cumsum(is_boundary)[~is_boundary]
+
+    @staticmethod
+    def __positions(cells: np.ndarray) -> np.ndarray:
+        """
+        セルの番号の配列(昇順)から、各値がセル内で何番目かを求める
+        """
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]]) if len(cells) > 0 else np.array([], dtype=int)
+        return np.arange(len(cells)) - np.repeat(starts, np.diff(np.r_[starts, len(cells)]))
+
+    @staticmethod
+    def __to_int(values: np.ndarray) -> np.ndarray:
+        """
+        数字の文字列の配列を整数にする。数字でないものは0にする
+        """
+        try:
+            return values.astype(np.int64)
+        except (ValueError, TypeError):
+            return pd.to_numeric(pd.Series(values), errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+
+    def __to_frame(self, bet_type: str) -> pd.DataFrame:
+        """
+        配列を、従来の馬券の種類ごとのDataFrameの形にする。
+        複勝は1レース1行で1~3着を列に、ワイドは(race_id, 何番目の払い戻しか)をindexにする。
+        """
+        payouts = self.__payouts[bet_type]
+        if bet_type == 'fukusho':
+            races, inverse = np.unique(payouts['race'], return_inverse=True)
+            wins = np.zeros((len(races), 3), dtype=np.int64)
+            returns = np.zeros((len(races), 3), dtype=np.int64)
+            wins[inverse, payouts['position']] = payouts['win'][:, 0]
+            returns[inverse, payouts['position']] = payouts['return']
+            df = pd.DataFrame(
+                np.hstack([wins, returns]),
+                index=self.__race_index[races],
+                columns=['win_0', 'win_1', 'win_2', 'return_0', 'return_1', 'return_2']
+                )
+            return df
+        race_ids = self.__race_index[payouts['race']]
+        if bet_type == 'tansho':
+            columns = ['win']
+        else:
+            columns = ['win_{}'.format(i) for i in range(self.N_HORSES[bet_type])]
+        df = pd.DataFrame(payouts['win'].astype(np.int64), index=race_ids, columns=columns)
+        df['return'] = payouts['return']
+        if bet_type == 'wide':
+            df.index = pd.MultiIndex.from_arrays([race_ids, payouts['position']])
+        return df
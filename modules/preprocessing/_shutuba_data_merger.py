@@ -5,6 +5,10 @@ from modules.preprocessing import ShutubaTableProcessor
 from modules.preprocessing import HorseResultsProcessor
 from modules.preprocessing import HorseInfoProcessor
 from modules.preprocessing import PedsProcessor
+from modules.preprocessing import HorseResultsSnapshot
+from modules.preprocessing import PedigreeAggregator
+from modules.preprocessing import PersonResultsAggregator
+from modules.preprocessing import FeatureSpec
 
 class ShutubaDataMerger(DataMerger):
     def __init__(self,
@@ -13,34 +17,80 @@ class ShutubaDataMerger(DataMerger):
                  horse_info_processor: HorseInfoProcessor,
                  peds_processor: PedsProcessor, 
                  target_cols: list, 
-                 group_cols: list
+                 group_cols: list,
+                 horse_results_snapshot: HorseResultsSnapshot = None,
+                 pedigree_aggregator: PedigreeAggregator = None,
+                 person_results_aggregator: PersonResultsAggregator = None,
+                 feature_spec: FeatureSpec = None
                  ):
         """
         初期処理
+        horse_results_snapshotを渡した場合、horse_results_processorはNoneでよい。
         """
         # レース結果テーブル（前処理後）
         self._results = shutuba_table_processor.preprocessed_data
         # 馬の過去成績テーブル（前処理後）
-        self._horse_results = horse_results_processor.preprocessed_data
+        if horse_results_processor is not None:
+            self._horse_results = horse_results_processor.preprocessed_data
+        # 前日までに作成した、馬ごとの過去成績の集計値
+        self._horse_results_snapshot = horse_results_snapshot
         # 馬の基本情報テーブル（前処理後）
-        self._horse_info = horse_info_processor.preprocessed_data
+        # 学習時と同じ列にするため、馬主情報は列を削除して別に持つ
+        horse_info = horse_info_processor.preprocessed_data
+        self._horse_info = horse_info.drop(['owner_id'], axis=1)
+        self._owner_ids = horse_info['owner_id']
         # 血統テーブル（前処理後）
         self._peds = peds_processor.preprocessed_data
         # 集計対象列
         self._target_cols = target_cols
         # horse_idと一緒にターゲットエンコーディングしたいカテゴリ変数
         self._group_cols = group_cols
+        # 産駒成績の集計器
+        self._pedigree_aggregator = pedigree_aggregator
+        # 騎手・調教師・馬主の成績の集計器
+        self._person_results_aggregator = person_results_aggregator
+        # 特徴量選択で残した特徴量の一覧
+        self._feature_spec = feature_spec
         # 全てのマージが完了したデータ
         self._merged_data = pd.DataFrame()
-        # 日付(date列)ごとに分かれたレース結果
-        self._separated_results_dict = {}
-        # レース結果データのdateごとに分かれた馬の過去成績
-        self._separated_horse_results_dict = {}
         
     def merge(self):
         """
         マージ処理
         """
         self._merge_horse_results()
+        self._merge_pedigree_results()
+        self._merge_owner_id()
+        # 列の並びが学習時と同じになるよう、DataMerger.mergeと同じ順にマージする
+        self._merge_person_results()
         self._merge_horse_info()
-        self._merge_peds()
\ No newline at end of file
+        self._merge_peds()
+
+    def _merge_owner_id(self):
+        """
+        出馬表にはowner_idがないので、馬の基本情報の馬主で補う。
+        学習時のowner_idはレース結果のもの(レース時点の馬主)だが、こちらは馬の基本情報を取得した時点の
+        馬主なので、その間に馬主が変わった馬では、馬主の成績の集計やowner_idの値が学習時の意味と異なる。
+        列の位置は、レース結果テーブルと同じくtrainer_idの次にする。
+        """
+        if len(self._merged_data) == 0:
+            return
+        owner_id = self._merged_data['horse_id'].map(self._owner_ids)
+        self._merged_data.insert(self._merged_data.columns.get_loc('trainer_id') + 1, 'owner_id', owner_id)
+    
+    def _merge_horse_results(self, n_races_list = [5, 9], n_jobs = 1):
+        """
+        馬の過去成績テーブルのマージ。
+        スナップショットがある場合は、過去成績を集計せずに集計済みの値を引く。
+        """
+        if self._horse_results_snapshot is None:
+            super()._merge_horse_results(n_races_list, n_jobs)
+            return
+        print('merging horse_results snapshot')
+        results = self._results[self._results['date'].notna()].sort_values('date', kind='stable')
+        summarized = self._horse_results_snapshot.transform(results, n_races_list)
+        if self._feature_spec is not None:
+            summarized = summarized[
+                [col for col in summarized.columns if self._feature_spec.keeps(col) or col == 'latest']
+                ]
+        self._merged_data = pd.concat([results, summarized], axis=1)
\ No newline at end of file
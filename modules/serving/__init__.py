@@ -0,0 +1,2 @@
+from ._prediction_server import PredictionServer
+from ._race_predictor import RacePredictor
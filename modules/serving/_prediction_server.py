@@ -0,0 +1,204 @@
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+from modules.constants import ResultsCols
+from modules.policies import AbstractScorePolicy, StdScorePolicy
+from modules.policies._score_policy import _PrecomputedModel
+from modules.training import DataSplitter, EnsembleModel, KeibaAI, ModelArtifact
+from modules.training._data_splitter import _to_matrix
+
+
+def _to_frame(X: pd.DataFrame) -> pd.DataFrame:
+    """
+    Categorical型の列をカテゴリの値にした、float32のDataFrame。
+    リクエストごとにカテゴリが異なっても、そのまま縦に結合できる。
+    """
+    return pd.DataFrame(_to_matrix(X), index=X.index, columns=X.columns)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict: {"race_ids": [...]} または {"rows": [{"race_id": ..., 列名: 値, ...}, ...]}
+    GET /health: 常駐しているレース数
+    """
+    def do_GET(self):
+        if self.path != '/health':
+            self.__send(404, {'error': 'not found'})
+            return
+        self.__send(200, {'status': 'ok', 'n_races': self.server.prediction_server.n_races})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.__send(404, {'error': 'not found'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            rows = body.get('rows')
+            if rows is not None:
+                rows = pd.DataFrame.from_records(rows).set_index('race_id')
+            score_table = self.server.prediction_server.predict(race_ids=body.get('race_ids'), rows=rows)
+        except (ValueError, KeyError) as e:
+            self.__send(400, {'error': str(e)})
+            return
+        self.__send(200, {'scores': score_table.reset_index(names='race_id').to_dict(orient='records')})
+
+    def log_message(self, format, *args):
+        # Unixソケットではクライアントのアドレスがないので、アクセスログは出さない
+        pass
+
+    def __send(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class PredictionServer:
+    """
+    学習済みモデルと当日分の特徴量を常駐させ、スコアを返すローカルのHTTPサーバー。
+    同時に届いたリクエストは、最大max_wait秒待ってまとめ、predict_probaを1回だけ呼ぶ。
+    複数のbotから同じプロセスに問い合わせれば、モデルの読み込みなどは起動時の1回で済む。
+    """
+    def __init__(
+        self,
+        keiba_ai: KeibaAI,
+        featured_data: pd.DataFrame = None,
+        score_policy: AbstractScorePolicy = StdScorePolicy,
+        max_batch_size: int = 64,
+        max_wait: float = 0.005
+        ):
+        """
+        keiba_aiには、KeibaAIFactory.load_artifactで読み込んだものを渡すと起動が速い。
+        featured_dataには、前日までに作った当日のレースの特徴量(FeatureEngineering.featured_data)を渡す。
+        """
+        self.__model = keiba_ai.model
+        self.__feature_names = self.__feature_names_of(keiba_ai)
+        self.__score_policy = score_policy
+        self.__max_batch_size = max_batch_size
+        self.__max_wait = max_wait
+        self.__features = pd.DataFrame()
+        if featured_data is not None:
+            self.set_features(featured_data)
+        self.__queue = queue.Queue()
+        self.__worker = threading.Thread(target=self.__run_batches, daemon=True)
+        self.__worker.start()
+        self.__httpd = None
+
+    def set_features(self, featured_data: pd.DataFrame):
+        """
+        常駐させる特徴量を入れ替える。出馬表が更新された場合などに使う。
+        """
+        self.__features = _to_frame(self.__select_features(featured_data)).sort_index(kind='stable')
+
+    @property
+    def n_races(self) -> int:
+        return self.__features.index.nunique()
+
+    def predict(self, race_ids: list = None, rows: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        race_idsのレースは常駐している特徴量から、rowsは渡された特徴量(indexはrace_id)からスコアを計算する。
+        複数スレッドから呼んでよく、同時に呼ばれた分はまとめて予測する。
+        """
+        X = []
+        if race_ids is not None:
+            race_ids = [str(race_id) for race_id in race_ids]
+            missing = set(race_ids) - set(self.__features.index)
+            if len(missing) > 0:
+                raise KeyError('race_ids not found: {}'.format(sorted(missing)))
+            X.append(self.__features.loc[race_ids])
+        if rows is not None:
+            X.append(_to_frame(self.__select_features(rows)))
+        if len(X) == 0:
+            raise ValueError('either race_ids or rows is required')
+        future = Future()
+        self.__queue.put((pd.concat(X) if len(X) > 1 else X[0], future))
+        return future.result()
+
+    def serve_forever(self, host: str = '127.0.0.1', port: int = 8765, unix_socket: str = None):
+        """
+        HTTPサーバーを起動する。unix_socketを指定した場合は、TCPではなくUnixソケットで待ち受ける。
+        """
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            self.__httpd = _UnixHTTPServer(unix_socket, _RequestHandler)
+            print('serving on {}'.format(unix_socket))
+        else:
+            self.__httpd = ThreadingHTTPServer((host, port), _RequestHandler)
+            print('serving on http://{}:{}'.format(host, port))
+        self.__httpd.prediction_server = self
+        try:
+            self.__httpd.serve_forever()
+        finally:
+            self.__httpd.server_close()
+            if unix_socket is not None and os.path.exists(unix_socket):
+                os.remove(unix_socket)
+
+    def shutdown(self):
+        """
+        別スレッドから呼んで、serve_foreverを終了させる
+        """
+        if self.__httpd is not None:
+            self.__httpd.shutdown()
+
+    def __select_features(self, X: pd.DataFrame) -> pd.DataFrame:
+        """
+        学習時の説明変数を、学習時の順に取り出す。
+        学習時の列名が分からない場合は、説明変数でない列(単勝オッズなど)を除く。
+        """
+        if self.__feature_names is not None:
+            return X[self.__feature_names]
+        return X.drop(DataSplitter.NON_FEATURE_COLS, axis=1, errors='ignore')
+
+    @staticmethod
+    def __feature_names_of(keiba_ai: KeibaAI) -> list:
+        model = keiba_ai.model
+        if isinstance(model, (ModelArtifact, EnsembleModel)) and model.feature_names is not None:
+            return list(model.feature_names)
+        if keiba_ai.datasets is not None:
+            return keiba_ai.datasets.X_train.columns.tolist()
+        return None
+
+    def __run_batches(self):
+        while True:
+            batch = [self.__queue.get()]
+            # 最初のリクエストからmax_wait秒以内に届いたものをまとめる
+            deadline = time.perf_counter() + self.__max_wait
+            while len(batch) < self.__max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.__queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.__predict_batch(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def __predict_batch(self, batch: list):
+        X_list = [X for X, _ in batch]
+        proba = self.__model.predict_proba(pd.concat(X_list) if len(X_list) > 1 else X_list[0])
+        offsets = np.cumsum([0] + [len(X) for X in X_list])
+        # レース内での標準化などは、リクエストごとに行う
+        for (X, future), start, end in zip(batch, offsets[:-1], offsets[1:]):
+            score_table = self.__score_policy.calc(_PrecomputedModel(proba[start:end]), X)
+            score_table[ResultsCols.UMABAN] = score_table[ResultsCols.UMABAN].astype(int)
+            future.set_result(score_table)
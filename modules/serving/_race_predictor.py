@@ -0,0 +1,125 @@
+import time
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+from modules.policies import AbstractScorePolicy, StdScorePolicy
+from modules.policies._score_policy import _PrecomputedModel
+from modules.training import EnsembleModel, KeibaAI, ModelArtifact
+
+
+class RacePredictor:
+    """
+    1レース分の予測を低遅延で行うクラス。
+    説明変数をモデルの特徴量の順に並べたfloat32の配列(バッファ)に置いておき、
+    pandasやsklearnのラッパーを通さずにブースターを直接呼ぶ。
+    オッズや馬体重の更新時は、バッファの該当列だけを書き換えて予測し直せばよい。
+    バッファを使い回すので、1つのインスタンスを複数スレッドから同時に使わないこと。
+    """
+    def __init__(self, model, feature_names: list, max_rows: int = 18):
+        """
+        modelはLGBMClassifier・ModelArtifact・EnsembleModelのいずれか。
+        feature_namesは学習時の説明変数の列名。max_rowsは1レースの最大頭数。
+        """
+        self.__model = model
+        self.__boosters = self.__boosters_of(model)
+        self.__feature_names = list(feature_names)
+        self.__column_index = {name: i for i, name in enumerate(self.__feature_names)}
+        self.__buffer = np.empty((max_rows, len(self.__feature_names)), dtype=np.float32)
+
+    @classmethod
+    def from_keiba_ai(cls, keiba_ai: KeibaAI, max_rows: int = 18) -> 'RacePredictor':
+        model = keiba_ai.model
+        if isinstance(model, (ModelArtifact, EnsembleModel)) and model.feature_names is not None:
+            feature_names = model.feature_names
+        else:
+            feature_names = keiba_ai.datasets.X_train.columns
+        return cls(model, feature_names, max_rows)
+
+    def layout(self, X: pd.DataFrame) -> np.ndarray:
+        """
+        1レース分の説明変数をバッファに書き込み、その行の範囲を返す。
+        Categorical型の列は、学習時と同じくカテゴリの値にする。
+        """
+        if len(X) > len(self.__buffer):
+            self.__buffer = np.empty((len(X), len(self.__feature_names)), dtype=np.float32)
+        rows = self.__buffer[:len(X)]
+        # 列ごとに取り出すとpandasのオーバーヘッドが大きいので、一度に変換する
+        rows[:] = X[self.__feature_names].to_numpy(dtype=np.float32, na_value=np.nan)
+        return rows
+
+    def column_index(self, col: str) -> int:
+        """
+        バッファでのcolの列番号。更新された列だけを書き換える時に使う。
+        """
+        return self.__column_index[col]
+
+    def predict(self, rows: np.ndarray) -> np.ndarray:
+        """
+        layoutと同じ列の並びのfloat32の配列から、各馬のスコア(1着になる確率)を計算する。
+        1レース分は行数が少ないので、スレッドを立てずに1スレッドで予測する。
+        """
+        if len(self.__boosters) == 1:
+            return self.__boosters[0].predict(rows, num_threads=1)
+        return np.mean([booster.predict(rows, num_threads=1) for booster in self.__boosters], axis=0)
+
+    def verify(
+        self,
+        keiba_ai: KeibaAI,
+        X: pd.DataFrame,
+        server=None,
+        score_policy: AbstractScorePolicy = StdScorePolicy,
+        rtol: float = 1e-5
+        ):
+        """
+        Xのレースについて、このクラスの予測から計算したスコアが、KeibaAI.calc_scoreと一致することを確認する。
+        serverにPredictionServerを渡した場合は、そのスコアも比較する(serverのscore_policyと揃えること)。
+        予測の経路ごとに説明変数の並びやCategorical型の扱いが食い違っていると、ValueErrorにする。
+        """
+        expected = keiba_ai.calc_score(X, score_policy)['score'].to_numpy()
+        proba = self.predict(self.layout(X))
+        score_tables = {
+            'RacePredictor': score_policy.calc(_PrecomputedModel(np.column_stack([1 - proba, proba])), X),
+            }
+        if server is not None:
+            score_tables['PredictionServer'] = server.predict(rows=X)
+        for name, score_table in score_tables.items():
+            actual = score_table['score'].to_numpy()
+            if not np.allclose(actual, expected, rtol=rtol, atol=1e-9, equal_nan=True):
+                raise ValueError('{} scores differ from calc_score: max diff {:.3g}'.format(
+                    name, np.nanmax(np.abs(actual - expected))
+                    ))
+
+    def benchmark(self, X: pd.DataFrame, n_repeat: int = 1000) -> pd.DataFrame:
+        """
+        Xの1レース分について、1回の予測にかかる時間(マイクロ秒)の中央値と99パーセンタイルを計測する。
+        - predict_proba: DataFrameをモデルのpredict_probaに渡す(従来の方法)
+        - layout+predict: DataFrameをバッファに書き込んでから予測する
+        - predict: バッファに書き込み済みの配列から予測する
+        """
+        rows = self.layout(X)
+        cases = {
+            'predict_proba': lambda: self.__model.predict_proba(X[self.__feature_names]),
+            'layout+predict': lambda: self.predict(self.layout(X)),
+            'predict': lambda: self.predict(rows),
+            }
+        latency = {}
+        for name, func in cases.items():
+            func()
+            elapsed = np.empty(n_repeat)
+            for i in range(n_repeat):
+                start = time.perf_counter_ns()
+                func()
+                elapsed[i] = time.perf_counter_ns() - start
+            latency[name] = {'median': np.median(elapsed) / 1000, 'p99': np.percentile(elapsed, 99) / 1000}
+        return pd.DataFrame.from_dict(latency, orient='index')
+
+    @staticmethod
+    def __boosters_of(model) -> list:
+        if isinstance(model, EnsembleModel):
+            return model.boosters
+        if isinstance(model, ModelArtifact):
+            return model.boosters
+        if isinstance(model, lgb.LGBMClassifier):
+            return [model.booster_]
+        raise TypeError('unsupported model: {}'.format(type(model).__name__))
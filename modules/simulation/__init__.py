@@ -1,3 +1,4 @@
+from ._payout_index import PayoutIndex
 from ._betting_tickets import BettingTickets
 from ._simulator import Simulator
 from ._plot import plot_single_threshold
\ No newline at end of file
@@ -1,20 +1,29 @@
+import numpy as np
+import pandas as pd
 from modules.preprocessing import ReturnProcessor
-from itertools import permutations
+from ._payout_index import PayoutIndex
+from itertools import combinations, permutations
 from scipy.special import comb
 
 class BettingTickets:
     """
     馬券の買い方と、賭けた時のリターンを計算する。
     """
+    # 馬券の種類ごとの、1枚の馬券に含まれる馬の数
+    N_HORSES = ReturnProcessor.N_HORSES
+    # 着順通りに当てる必要がある馬券の種類
+    ORDERED_BET_TYPES = ('umatan', 'sanrentan')
+
     def __init__(self, returnProcessor: ReturnProcessor) -> None:
-        self.__returnTables = returnProcessor.preprocessed_data
-        self.__returnTablesTansho = self.__returnTables['tansho']
-        self.__returnTablesFukusho = self.__returnTables['fukusho']
-        self.__returnTablesUmaren = self.__returnTables['umaren']
-        self.__returnTablesUmatan = self.__returnTables['umatan']
-        self.__returnTablesWide = self.__returnTables['wide']
-        self.__returnTablesSanrenpuku = self.__returnTables['sanrenpuku']
-        self.__returnTablesSanrentan = self.__returnTables['sanrentan']
+        self.__returnProcessor = returnProcessor
+        # 払い戻しのある組み合わせを、整数のキーで引く索引
+        self.__payoutIndex = PayoutIndex(
+            {bet_type: self.payout_codes(bet_type) for bet_type in self.N_HORSES}
+            )
+
+    @property
+    def payout_index(self) -> PayoutIndex:
+        return self.__payoutIndex
 
     def bet_tansho(self, race_id: str, umaban: list, amount: float):
         """
@@ -29,12 +38,8 @@ class BettingTickets:
         else:
             # 賭けた合計額
             bet_amount = n_bets * amount
-            # 賭けるレースidに絞った単勝の払い戻し表
-            table_1R = self.__returnTablesTansho.loc[race_id]
-            # 的中判定
-            hit = table_1R['win'] in umaban
             # 払い戻し合計額
-            return_amount = hit * table_1R['return'] * amount / 100
+            return_amount = self.__return_amount(race_id, 'tansho', self.box('tansho', umaban), amount)
             return n_bets, bet_amount, return_amount
 
     def bet_fukusho(self, race_id: str, umaban: list, amount: float):
@@ -48,15 +53,8 @@ class BettingTickets:
         else:
             # 賭けた合計額
             bet_amount = n_bets * amount
-            # 賭けるレースidに絞った複勝の払い戻し表
-            table_1R = self.__returnTablesFukusho.loc[race_id]
-            # 1~3着それぞれに的中判定
-            hits = table_1R[['win_0', 'win_1', 'win_2']].isin(umaban)
-            # 払い戻し合計額
-            return_amount = sum(
-                hits.values * table_1R[['return_0', 'return_1', 'return_2']].values \
-                    * amount / 100
-            )
+            # 払い戻し合計額。1~3着それぞれに的中判定する
+            return_amount = self.__return_amount(race_id, 'fukusho', self.box('fukusho', umaban), amount)
             return n_bets, bet_amount, return_amount
 
     def bet_umaren_box(self, race_id: str, umaban: list, amount: float):
@@ -72,12 +70,8 @@ class BettingTickets:
         else:
             # 賭けた合計額
             bet_amount = n_bets * amount
-            # 賭けるレースidに絞った馬連払い戻し表
-            table_1R = self.__returnTablesUmaren.loc[race_id]
-            # 的中判定
-            hit = set(table_1R[['win_0', 'win_1']]).issubset(set(umaban))
             # 払い戻し合計額
-            return_amount = hit * table_1R['return'] * amount / 100
+            return_amount = self.__return_amount(race_id, 'umaren', self.box('umaren', umaban), amount)
         return n_bets, bet_amount, return_amount
 
     def _bet_umatan(self, race_id: str, umaban: list, amount: float):
@@ -88,31 +82,21 @@ class BettingTickets:
         if len(umaban) != 2:
             print('例外')
             return 0, 0, 0
-
-        # 賭けるレースidに絞った馬単払い戻し表
-        table_1R = self.__returnTablesUmatan.loc[race_id]
-        # 的中判定
-        hit = (table_1R['win_0'] == umaban[0]) * (table_1R['win_1'] == umaban[1])
         # 払い戻し合計額
-        return_amount = hit * table_1R['return'] * amount / 100
+        return_amount = self.__return_amount(race_id, 'umatan', [umaban], amount)
         return 1, amount, return_amount
 
     def bet_umatan_box(self, race_id: str, umaban: list, amount: float):
         """
         馬単をBOX馬券で賭ける場合の関数。
         """
-        n_bets = 0
-        bet_amount = 0
-        return_amount = 0
-        for pair in permutations(umaban, 2):
-            n_bets_single, bet_amount_single, return_amount_single \
-                = self._bet_umatan(race_id, list(pair), amount)
-            # 賭ける枚数
-            n_bets += n_bets_single
-            # 賭けた合計額
-            bet_amount += bet_amount_single
-            # 払い戻し合計額
-            return_amount += return_amount_single
+        tickets = self.box('umatan', umaban)
+        # 賭ける枚数
+        n_bets = len(tickets)
+        # 賭けた合計額
+        bet_amount = n_bets * amount
+        # 払い戻し合計額
+        return_amount = self.__return_amount(race_id, 'umatan', tickets, amount)
         return n_bets, bet_amount, return_amount
 
     def bet_wide_box(self, race_id: str, umaban: list, amount: float):
@@ -123,14 +107,8 @@ class BettingTickets:
         n_bets = comb(len(umaban), 2)
         # 賭けた合計額
         bet_amount = n_bets * amount
-        # 賭けるレースidに絞ったワイド払い戻し表
-        table_1R = self.__returnTablesWide.loc[race_id]
-        # 的中判定
-        hits = table_1R['win_0'].isin(umaban) * table_1R['win_1'].isin(umaban)
-        # 払い戻し合計額
-        return_amount = sum(
-            hits * table_1R['return'] * amount / 100
-        )
+        # 払い戻し合計額。1レースに的中の組み合わせが3つある
+        return_amount = self.__return_amount(race_id, 'wide', self.box('wide', umaban), amount)
         return n_bets, bet_amount, return_amount
 
     def bet_sanrenpuku_box(self, race_id: str, umaban: list, amount: float):
@@ -141,46 +119,104 @@ class BettingTickets:
         n_bets = comb(len(umaban), 3)
         # 賭けた合計額
         bet_amount = n_bets * amount
-        # 賭けるレースidに絞った三連複払い戻し表
-        table_1R = self.__returnTablesSanrenpuku.loc[race_id]
-        # 的中判定
-        hit = set(table_1R[['win_0', 'win_1', 'win_2']]).issubset(set(umaban))
         # 払い戻し合計額
-        return_amount = hit * table_1R['return'] * amount / 100
+        return_amount = self.__return_amount(race_id, 'sanrenpuku', self.box('sanrenpuku', umaban), amount)
         return n_bets, bet_amount, return_amount
 
     def _bet_sanrentan(self, race_id: str, umaban: list, amount: float):
         """
         三連単を一枚のみ賭ける場合の関数。umabanは[1着予想, 2着予想, 3着予想]の形で馬番を入れる。
         """
-        #len(umaban) != 3の時の例外処理
-        # 賭けるレースidに絞った三連単払い戻し表
-        table_1R = self.__returnTablesSanrentan.loc[race_id]
-        # 的中判定
-        hit = (table_1R['win_0'] == umaban[0]) * (table_1R['win_1'] == umaban[1]) \
-            * (table_1R['win_2'] == umaban[2])
         # 払い戻し合計額
-        return_amount = hit * table_1R['return'] * amount / 100
+        return_amount = self.__return_amount(race_id, 'sanrentan', [umaban], amount)
         return 1, amount, return_amount
 
     def bet_sanrentan_box(self, race_id: str, umaban: list, amount: float):
         """
         三連単をBOX馬券で賭ける場合の関数。
         """
-        n_bets = 0
-        bet_amount = 0
-        return_amount = 0
-        for pair in permutations(umaban, 3):
-            n_bets_single, bet_amount_single, return_amount_single \
-                = self._bet_sanrentan(race_id, list(pair), amount)
-            # 賭ける枚数
-            n_bets += n_bets_single
-            # 賭けた合計額
-            bet_amount += bet_amount_single
-            # 払い戻し合計額
-            return_amount += return_amount_single
+        tickets = self.box('sanrentan', umaban)
+        # 賭ける枚数
+        n_bets = len(tickets)
+        # 賭けた合計額
+        bet_amount = n_bets * amount
+        # 払い戻し合計額
+        return_amount = self.__return_amount(race_id, 'sanrentan', tickets, amount)
         return n_bets, bet_amount, return_amount
 
+    def __return_amount(self, race_id: str, bet_type: str, tickets: list, amount: float) -> float:
+        """
+        race_idのレースで、ticketsの馬番の組み合わせを1枚ずつ買った場合の払い戻し合計額
+        """
+        if len(tickets) == 0:
+            return 0
+        payouts = self.__payoutIndex.race_payouts(race_id, bet_type, self.encode(bet_type, tickets).tolist())
+        return sum(payouts) * amount / 100
+
+    def payouts(self, bet_type: str) -> tuple:
+        """
+        bet_typeの払い戻しを、(race_idの配列, 的中に必要な馬番の2次元配列, 払戻金の配列)にする。
+        BOX馬券は着順に関わらず、必要な馬番を全て含めば的中する。
+        """
+        payouts = self.__returnProcessor.payouts(bet_type)
+        race_ids = self.__returnProcessor.race_index[payouts['race']].to_numpy()
+        return race_ids, payouts['win'].astype(float), payouts['return'].astype(float)
+
+    @classmethod
+    def box(cls, bet_type: str, umaban: list) -> list:
+        """
+        umabanの馬にBOXで賭けた場合の、1枚ごとの馬番の組み合わせ。
+        単勝・複勝は1頭ずつの馬券になる。
+        """
+        n_horses = cls.N_HORSES[bet_type]
+        if bet_type == 'umaren' and len(umaban) == 2:
+            # bet_umaren_boxと同じく、2頭の場合は賭けない
+            return []
+        if bet_type in cls.ORDERED_BET_TYPES:
+            return list(permutations(umaban, n_horses))
+        return list(combinations(umaban, n_horses))
+
+    @classmethod
+    def encode(cls, bet_type: str, umaban: np.ndarray) -> np.ndarray:
+        """
+        馬番の組み合わせ(1行が1枚の馬券)を、整数のキーにする。
+        着順が関係ない馬券は馬番のビットの和、関係ある馬券は馬番を5ビットずつ並べたもの。
+        """
+        umaban = np.asarray(umaban, dtype=np.int64).reshape(len(umaban), -1)
+        if bet_type in cls.ORDERED_BET_TYPES:
+            shifts = 5 * np.arange(umaban.shape[1] - 1, -1, -1)
+            return (umaban << shifts).sum(axis=1)
+        return (np.int64(1) << umaban).sum(axis=1)
+
+    def payout_codes(self, bet_type: str) -> tuple:
+        """
+        払い戻しのある組み合わせを、(race_idの配列, encodeしたキーの配列, 払戻金の配列)にする。
+        """
+        race_ids, umaban, returns = self.payouts(bet_type)
+        valid = (np.nan_to_num(umaban) > 0).all(axis=1) & (np.nan_to_num(returns) > 0)
+        return race_ids[valid], self.encode(bet_type, umaban[valid]), returns[valid]
+
+    @staticmethod
+    def n_bets_of(bet_type: str, n_horses: np.ndarray) -> np.ndarray:
+        """
+        n_horses頭に賭けた場合の、bet_typeの馬券の枚数
+        """
+        k = np.asarray(n_horses, dtype=float)
+        if bet_type in ('tansho', 'fukusho'):
+            return k
+        if bet_type == 'umaren':
+            # bet_umaren_boxと同じく、2頭の場合は賭けない
+            return np.where(k >= 3, k * (k - 1) / 2, 0)
+        if bet_type == 'umatan':
+            return k * (k - 1)
+        if bet_type == 'wide':
+            return k * (k - 1) / 2
+        if bet_type == 'sanrenpuku':
+            return k * (k - 1) * (k - 2) / 6
+        if bet_type == 'sanrentan':
+            return k * (k - 1) * (k - 2)
+        raise ValueError('unknown bet_type: {}'.format(bet_type))
+
     def others(self, race_id: str, umaban: list, amount: float):
         """
         その他、フォーメーション馬券や流し馬券の定義
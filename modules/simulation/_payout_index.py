@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+
+class PayoutIndex:
+    """
+    払い戻しのある全ての組み合わせを、1つのint64のキーで引けるようにした索引。
+    キーは(レースの通し番号, 馬券の種類, 馬番の組み合わせのコード)を詰めたもので、
+    ハッシュ表で引くので、馬券の種類によらず的中判定は定数時間で済む。
+    保持するのはキーと払戻金だけなので、常駐させても小さい。
+    """
+    # 馬番の組み合わせのコード(BettingTickets.encode)に使うビット数
+    CODE_BITS = 20
+    # 馬券の種類の番号に使うビット数
+    BET_TYPE_BITS = 3
+
+    def __init__(self, payout_codes: dict):
+        """
+        payout_codesは、馬券の種類ごとの(race_idの配列, コードの配列, 払戻金の配列)。
+        同じキーが複数ある場合(同着など)は払戻金を合計する。
+        """
+        self.__bet_types = pd.Index(list(payout_codes))
+        self.__race_index = pd.Index(
+            np.concatenate([race_ids for race_ids, _, _ in payout_codes.values()])
+            ).unique()
+        keys = np.concatenate([
+            self.__pack(self.__race_index.get_indexer(race_ids), i, codes)
+            for i, (race_ids, codes, _) in enumerate(payout_codes.values())
+            ])
+        returns = pd.Series(np.concatenate([returns for _, _, returns in payout_codes.values()]))
+        returns = returns.groupby(keys).sum()
+        self.__keys = pd.Index(returns.index.to_numpy(dtype=np.int64))
+        self.__returns = returns.to_numpy(dtype=float)
+        # 1レース分を引く時は、pandasを通さずにdictで引く
+        self.__race_codes = {race_id: i for i, race_id in enumerate(self.__race_index)}
+        self.__bet_type_codes = {bet_type: i for i, bet_type in enumerate(self.__bet_types)}
+        self.__payouts = dict(zip(self.__keys.tolist(), self.__returns.tolist()))
+
+    def lookup(self, race_ids, bet_types, codes) -> np.ndarray:
+        """
+        馬券ごとの払戻金(100円あたり)。外れた馬券と、払い戻し表にないレースの馬券は0。
+        bet_typesは、全ての馬券で同じ場合は文字列で渡してよい。
+        """
+        race_codes = self.__race_index.get_indexer(race_ids)
+        if isinstance(bet_types, str):
+            bet_type_codes = self.__bet_types.get_loc(bet_types)
+        else:
+            bet_type_codes = self.__bet_types.get_indexer(bet_types)
+        idx = self.__keys.get_indexer(self.__pack(race_codes, bet_type_codes, np.asarray(codes, dtype=np.int64)))
+        # レースが見つからない場合のキーは負になり、どのキーとも一致しない
+        return np.where(idx >= 0, self.__returns[idx], 0.)
+
+    def race_payouts(self, race_id: str, bet_type: str, codes) -> list:
+        """
+        1レースの馬券ごとの払戻金(100円あたり)。外れた場合は0。
+        """
+        race_code = self.__race_codes.get(race_id)
+        if race_code is None:
+            return [0.] * len(codes)
+        base = int(self.__pack(race_code, self.__bet_type_codes[bet_type], 0))
+        return [self.__payouts.get(base | code, 0.) for code in codes]
+
+    @property
+    def race_index(self) -> pd.Index:
+        """
+        レースの通し番号とrace_idの対応
+        """
+        return self.__race_index
+
+    @property
+    def nbytes(self) -> int:
+        return self.__keys.nbytes + self.__returns.nbytes
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
+    @classmethod
+    def __pack(cls, race_codes, bet_type_codes, codes):
+        race_codes = np.asarray(race_codes, dtype=np.int64)
+        bet_type_codes = np.asarray(bet_type_codes, dtype=np.int64)
+        return (race_codes << (cls.BET_TYPE_BITS + cls.CODE_BITS)) | (bet_type_codes << cls.CODE_BITS) | codes
@@ -1,10 +1,22 @@
 import numpy as np
 import pandas as pd
 
+from modules.constants import ResultsCols
 from modules.preprocessing import ReturnProcessor
 from ._betting_tickets import BettingTickets
 
 
+def _sum_above(keys: np.ndarray, weights: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """
+    thresholdsのそれぞれについて、keyがthreshold以上のweightの合計。
+    keyで1回だけソートし、累積和を二分探索で引く。
+    """
+    order = np.argsort(keys, kind='stable')
+    cumsum = np.concatenate([[0], np.cumsum(weights[order])])
+    idx = np.searchsorted(keys[order], thresholds, side='left')
+    return cumsum[-1] - cumsum[idx]
+
+
 class Simulator:
     """
     賭けた馬券を元に、成績を記録していくクラス。
@@ -12,6 +24,51 @@ class Simulator:
     def __init__(self, return_processor: ReturnProcessor) -> None:
         self.betting_tickets = BettingTickets(return_processor)
 
+    def to_bets(self, actions: dict) -> pd.DataFrame:
+        """
+        KeibaAI.decideActionの出力を、1行が1枚の馬券のDataFrame(race_id, bet_type, code)にする。
+        codeはBettingTickets.encodeした馬番の組み合わせで、BOX馬券は1枚ずつに展開する。
+        """
+        ticket_race_ids = {bet_type: [] for bet_type in BettingTickets.N_HORSES}
+        tickets = {bet_type: [] for bet_type in BettingTickets.N_HORSES}
+        for race_id, action in actions.items():
+            for bet_type, umaban in action.items():
+                box = BettingTickets.box(bet_type, umaban)
+                ticket_race_ids[bet_type] += [race_id] * len(box)
+                tickets[bet_type] += box
+        race_ids, bet_types, codes = [], [], []
+        for bet_type in BettingTickets.N_HORSES:
+            if len(tickets[bet_type]) == 0:
+                continue
+            race_ids.append(np.array(ticket_race_ids[bet_type], dtype=object))
+            bet_types.append(np.full(len(tickets[bet_type]), bet_type, dtype=object))
+            codes.append(BettingTickets.encode(bet_type, tickets[bet_type]))
+        if len(codes) == 0:
+            return pd.DataFrame({'race_id': [], 'bet_type': [], 'code': np.array([], dtype=np.int64)})
+        return pd.DataFrame({
+            'race_id': np.concatenate(race_ids),
+            'bet_type': np.concatenate(bet_types),
+            'code': np.concatenate(codes),
+            })
+
+    def calc_returns_per_bets(self, bets: pd.DataFrame, race_ids: list = None) -> pd.DataFrame:
+        """
+        to_betsの出力(1行が1枚の馬券)の払戻金をPayoutIndexで引き、calc_returns_per_raceと同じ形で集計する。
+        race_idsを渡した場合は、馬券を買わなかったレースも0として含め、その順に並べる。
+        """
+        returns = self.betting_tickets.payout_index.lookup(bets['race_id'], bets['bet_type'], bets['code'])
+        if race_ids is None:
+            race_ids = pd.unique(bets['race_id'])
+        race_codes = pd.Index(race_ids).get_indexer(bets['race_id'])
+        n_bets = np.bincount(race_codes, minlength=len(race_ids))
+        return_amount = np.bincount(race_codes, weights=returns, minlength=len(race_ids)) / 100
+        return pd.DataFrame({
+            'n_bets': n_bets,
+            'bet_amount': n_bets,
+            'return_amount': return_amount,
+            'hit_or_not': (return_amount > 0).astype(int),
+            }, index=race_ids)
+
     def calc_returns_per_race(self, actions: dict) -> pd.DataFrame:
         """
         KeibaAI.decideActionの出力を入れると、レースごとに
@@ -21,53 +78,10 @@ class Simulator:
         - return_amount: そのレースでの払戻金
         - hit_or_not: 的中したかどうか
 
-        が返ってくる。
+        が返ってくる。馬券は1枚に1ずつ賭ける。
         """
-        returns_per_race_dict = {}
-        for race_id in actions:
-            n_bets_race = 0
-            bet_amount_race = 0
-            return_amount_race = 0
-            for action in actions[race_id]:
-                #actionの定義を別途した方が良いかも
-                if action == 'tansho':
-                    n_bets, bet_amount, return_amount = self.betting_tickets.bet_tansho(
-                        race_id, actions[race_id][action], 1
-                        )
-                elif action == 'fukusho':
-                    n_bets, bet_amount, return_amount = self.betting_tickets.bet_fukusho(
-                        race_id, actions[race_id][action], 1
-                        )
-                elif action == 'umaren':
-                    n_bets, bet_amount, return_amount = self.betting_tickets.bet_umaren_box(
-                        race_id, actions[race_id][action], 1
-                        )
-                elif action == 'umatan':
-                    n_bets, bet_amount, return_amount = self.betting_tickets.bet_umatan_box(
-                        race_id, actions[race_id][action], 1
-                        )
-                elif action == 'wide':
-                    n_bets, bet_amount, return_amount = self.betting_tickets.bet_wide_box(
-                        race_id, actions[race_id][action], 1
-                        )
-                elif action == 'sanrenpuku':
-                    n_bets, bet_amount, return_amount = self.betting_tickets.bet_sanrenpuku_box(
-                        race_id, actions[race_id][action], 1
-                        )
-                elif action == 'sanrentan':
-                    n_bets, bet_amount, return_amount = self.betting_tickets.bet_sanrentan_box(
-                        race_id, actions[race_id][action], 1
-                        )
-                n_bets_race += n_bets
-                bet_amount_race += bet_amount
-                return_amount_race += return_amount
-                returns_per_race_dict[race_id] = {
-                    'n_bets': n_bets_race,
-                    'bet_amount': bet_amount_race,
-                    'return_amount': return_amount_race,
-                    'hit_or_not': int(return_amount_race > 0)
-                }
-        return pd.DataFrame.from_dict(returns_per_race_dict, orient='index')
+        race_ids = [race_id for race_id in actions if len(actions[race_id]) > 0]
+        return self.calc_returns_per_bets(self.to_bets(actions), race_ids)
 
     def calc_returns(self, actions: dict) -> dict:
         """
@@ -93,3 +107,92 @@ class Simulator:
                 returns_dict['std'] = returns_per_race['return_amount'].std() * np.sqrt(returns_dict['n_races']) \
                     / returns_dict['total_bet_amount']
         return returns_dict
+
+    def sweep(self, score_table: pd.DataFrame, bet_policy, thresholds) -> pd.DataFrame:
+        """
+        bet_policy.judge(score_table, threshold)をcalc_returnsで集計した結果を、
+        thresholdsの全ての値についてまとめて計算し、thresholdをindexにしたDataFrameで返す。
+        賭けるレースがないthresholdの行はNaNになる。
+
+        bet_policyがBET_TYPEとMIN_HORSESを持つ場合は、スコアをレースごとに1回だけ並べ替え、
+        thresholdを下げた時に増える馬券の枚数と払戻金を累積して計算する。
+        持たない場合は、thresholdごとにjudgeとcalc_returnsを呼ぶ。
+        """
+        thresholds = np.asarray(thresholds, dtype=float)
+        if not hasattr(bet_policy, 'BET_TYPE'):
+            returns = [self.calc_returns(bet_policy.judge(score_table, threshold=t)) for t in thresholds]
+        else:
+            returns = self.__sweep_sorted(score_table, bet_policy.BET_TYPE, bet_policy.MIN_HORSES, thresholds)
+        columns = ['n_bets', 'n_races', 'n_hits', 'total_bet_amount', 'return_rate', 'std']
+        return pd.DataFrame(returns, index=pd.Index(thresholds, name='threshold'), columns=columns)
+
+    def __sweep_sorted(self, score_table: pd.DataFrame, bet_type: str, min_horses: int, thresholds: np.ndarray) -> list:
+        race_index = pd.Index(score_table.index.get_level_values(0).unique())
+        race_codes = race_index.get_indexer(score_table.index.get_level_values(0))
+        scores = score_table['score'].to_numpy(dtype=float)
+        umaban = score_table[ResultsCols.UMABAN].to_numpy(dtype=float)
+        # レースごとにスコアの高い順に並べ、各馬が何番目に賭けに加わるかを求める
+        order = np.lexsort((-scores, race_codes))
+        race_codes, scores, umaban = race_codes[order], scores[order], umaban[order]
+        starts = np.flatnonzero(np.r_[True, race_codes[1:] != race_codes[:-1]])
+        ranks = np.arange(len(scores)) - np.repeat(starts, np.diff(np.r_[starts, len(scores)])) + 1
+        # thresholdを下げてranks頭目の馬が加わった時に増える馬券の枚数
+        bet_increments = BettingTickets.n_bets_of(bet_type, ranks) - BettingTickets.n_bets_of(bet_type, ranks - 1)
+        n_bets = _sum_above(scores, bet_increments, thresholds)
+        n_races = _sum_above(scores[ranks == min_horses], np.ones((ranks == min_horses).sum()), thresholds)
+
+        # (レース, 馬番)ごとのスコア。出走していない馬番は-inf
+        umaban_idx = np.nan_to_num(umaban, nan=0).astype(int)
+        score_matrix = np.full((len(race_index), umaban_idx.max(initial=0) + 1), -np.inf)
+        score_matrix[race_codes, umaban_idx] = scores
+        score_matrix[:, 0] = -np.inf
+
+        # 払戻金ごとに、的中に必要な馬が全て賭けに加わるthreshold(必要な馬のスコアの最小値)を求める
+        payout_races, payout_umaban, payout_returns = self.betting_tickets.payouts(bet_type)
+        payout_codes = race_index.get_indexer(payout_races)
+        valid = (payout_codes >= 0) & (np.nan_to_num(payout_returns) > 0)
+        payout_codes, payout_umaban, payout_returns = payout_codes[valid], payout_umaban[valid], payout_returns[valid]
+        payout_umaban = np.nan_to_num(payout_umaban, nan=0).astype(int)
+        payout_umaban[(payout_umaban < 0) | (payout_umaban >= score_matrix.shape[1])] = 0
+        keys = score_matrix[payout_codes[:, None], payout_umaban].min(axis=1)
+        if bet_type == 'umaren':
+            # bet_umaren_boxと同じく、3頭以上に賭けた場合のみ払い戻される
+            third = np.full(len(race_index), -np.inf)
+            third[race_codes[ranks == 3]] = scores[ranks == 3]
+            keys = np.minimum(keys, third[payout_codes])
+        payout_returns = payout_returns / 100
+
+        # レースごとの払戻金の2乗和は、同じレースの払戻金をkeyの高い順に加えた時の増分の和になる
+        payout_order = np.lexsort((-keys, payout_codes))
+        keys, payout_codes, payout_returns = keys[payout_order], payout_codes[payout_order], payout_returns[payout_order]
+        cum_returns = pd.Series(payout_returns).groupby(payout_codes).cumsum().to_numpy()
+        square_increments = cum_returns ** 2 - (cum_returns - payout_returns) ** 2
+        return_amount = _sum_above(keys, payout_returns, thresholds)
+        return_square = _sum_above(keys, square_increments, thresholds)
+        # 的中したレース数は、レースごとに最初に払い戻されるthresholdで数える
+        hit_keys = pd.Series(keys).groupby(payout_codes).max().to_numpy()
+        n_hits = _sum_above(hit_keys, np.ones(len(hit_keys)), thresholds)
+
+        returns = []
+        for i in range(len(thresholds)):
+            if n_races[i] == 0:
+                returns.append({})
+                continue
+            total_bet_amount = n_bets[i]
+            if total_bet_amount == 0:
+                return_rate, std = 0, 0
+            else:
+                return_rate = return_amount[i] / total_bet_amount
+                n = n_races[i]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    var = (return_square[i] - return_amount[i] ** 2 / n) / (n - 1)
+                std = np.sqrt(max(var, 0)) * np.sqrt(n) / total_bet_amount if n > 1 else np.nan
+            returns.append({
+                'n_bets': n_bets[i],
+                'n_races': int(n_races[i]),
+                'n_hits': int(n_hits[i]),
+                'total_bet_amount': total_bet_amount,
+                'return_rate': return_rate,
+                'std': std,
+                })
+        return returns
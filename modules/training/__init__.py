@@ -1,4 +1,9 @@
 from ._data_splitter import DataSplitter
+from ._walk_forward_splitter import WalkForwardSplitter
+from ._cross_validator import CrossValidator
+from ._ensemble_model import EnsembleModel
+from ._feature_selector import FeatureSelector
 from ._keiba_ai import KeibaAI
 from ._keiba_ai_factory import KeibaAIFactory
-from ._model_wrapper import ModelWrapper
\ No newline at end of file
+from ._model_wrapper import ModelWrapper
+from ._model_artifact import ModelArtifact
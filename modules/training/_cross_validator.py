@@ -0,0 +1,81 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import lightgbm as lgb
+from sklearn.metrics import roc_auc_score
+from tqdm.auto import tqdm
+
+from ._walk_forward_splitter import WalkForwardSplitter
+from modules.policies import AbstractBetPolicy, AbstractScorePolicy
+from modules.preprocessing import ReturnProcessor
+from modules.simulation import Simulator
+
+
+# 並列処理時に、各プロセスが読み取り専用で共有するCrossValidator
+_shared_validator = None
+
+def _init_worker(validator):
+    global _shared_validator
+    _shared_validator = validator
+
+def _run_fold(args):
+    fold, params = args
+    return _shared_validator.run_fold(fold, params)
+
+
+class CrossValidator:
+    """
+    WalkForwardSplitterの各foldで学習・評価を行うクラス。
+    foldごとにテストデータのAUCと、bet_policyで賭けた場合の回収率を計算する。
+    """
+    def __init__(
+        self,
+        splitter: WalkForwardSplitter,
+        score_policy: AbstractScorePolicy,
+        bet_policy: AbstractBetPolicy,
+        return_processor: ReturnProcessor = None,
+        **bet_params
+        ):
+        """
+        bet_paramsにはbet_policy.judgeに渡すthresholdなどを入れる。
+        return_processorを渡さない場合は、回収率を計算しない。
+        """
+        self.__splitter = splitter
+        self.__score_policy = score_policy
+        self.__bet_policy = bet_policy
+        self.__simulator = Simulator(return_processor) if return_processor is not None else None
+        self.__bet_params = bet_params
+
+    def run(self, params: dict = {}, n_jobs: int = -1) -> pd.DataFrame:
+        """
+        全てのfoldを複数プロセスで並列に実行する。n_jobs=-1の場合はCPUのコア数。
+        各プロセスのLightGBMのスレッド数は、コア数をプロセス数で割ったものにする。
+        """
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        n_jobs = min(n_jobs, self.__splitter.n_splits)
+        params = dict(params)
+        params.setdefault('n_jobs', max(1, os.cpu_count() // n_jobs))
+        folds = [(fold, params) for fold in range(self.__splitter.n_splits)]
+        if n_jobs == 1:
+            scores = [self.run_fold(fold, params) for fold, params in tqdm(folds)]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(self,)) as executor:
+                scores = list(tqdm(executor.map(_run_fold, folds), total=len(folds)))
+        return pd.concat([self.__splitter.folds, pd.DataFrame(scores)], axis=1)
+
+    def run_fold(self, fold: int, params: dict = {}) -> dict:
+        """
+        fold番目の訓練データで学習し、テストデータで評価する
+        """
+        model = lgb.LGBMClassifier(objective='binary', **params)
+        model.fit(*self.__splitter.train_arrays(fold))
+        X_test, y_test = self.__splitter.test_arrays(fold)
+        scores = {'auc': roc_auc_score(y_test, model.predict_proba(X_test)[:, 1])}
+        if self.__simulator is not None:
+            score_table = self.__score_policy.calc(model, self.__splitter.X_test(fold))
+            actions = self.__bet_policy.judge(score_table, **self.__bet_params)
+            returns = self.__simulator.calc_returns(actions)
+            scores['n_bets'] = returns.get('n_bets', 0)
+            scores['return_rate'] = returns.get('return_rate', 0)
+        return scores
@@ -1,45 +1,153 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import lightgbm
 import optuna_integration.lightgbm as lgb_o
 
-from modules.constants import ResultsCols
+from modules.constants import LocalPaths, ResultsCols
+
+
+def _sort_by_date(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    日付順に並べる。同じレースの行は、元の並びのまま連続させる。
+    """
+    df = df.sort_values('date', kind='stable')
+    race_codes = pd.factorize(df.index)[0]
+    return df.iloc[np.argsort(race_codes, kind='stable')]
+
+def _to_matrix(features: pd.DataFrame) -> np.ndarray:
+    """
+    説明変数をfloat32の配列にする。Categorical型の列はカテゴリの値(エンコード後のIDなど)になる。
+    """
+    matrix = np.empty(features.shape, dtype=np.float32)
+    for i, (_, column) in enumerate(features.items()):
+        matrix[:, i] = column.to_numpy(dtype=np.float32, na_value=np.nan)
+    return matrix
 
 
 class DataSplitter:
-    def __init__(self, featured_data, test_size, valid_size) -> None:
+    # 説明変数に含めない列
+    NON_FEATURE_COLS = ['rank', 'date', ResultsCols.TANSHO_ODDS]
+    # optuna用のデータセットを作る時のパラメータ。optunaのチューニング時の設定に合わせる
+    LGB_DATASET_PARAMS = {'feature_pre_filter': False, 'verbose': -1}
+
+    def __init__(self, featured_data, test_size, valid_size, dataset_dir: str = LocalPaths.LGB_DATASET_DIR) -> None:
+        """
+        dataset_dirには、optuna用のLightGBMのデータセットをバイナリ形式で保存する。
+        同じデータで再度チューニングする時は、保存したものを読み込んでビン分割を省略する。
+        """
         self.__featured_data = featured_data
+        self.__dataset_dir = dataset_dir
         self.train_valid_test_split(test_size, valid_size)
 
     def train_valid_test_split(self, test_size, valid_size):
         """
         訓練データとテストデータに分ける。さらに訓練データをoptuna用の訓練データと検証データに分ける。
+        データを日付順に並べておき、各データは行の範囲で切り出す。
+        """
+        data = _sort_by_date(self.__featured_data)
+        n_train = self.__split_point(data.index, len(data), test_size)
+        n_train_optuna = self.__split_point(data.index[:n_train], n_train, valid_size)
+
+        self.__train_data = data.iloc[:n_train]
+        self.__test_data = data.iloc[n_train:]
+        self.__train_data_optuna = data.iloc[:n_train_optuna]
+        self.__valid_data_optuna = data.iloc[n_train_optuna:n_train]
+        # 説明変数と目的変数に分ける
+        features = data.drop(self.NON_FEATURE_COLS, axis=1)
+        self.__X_train = features.iloc[:n_train]
+        self.__y_train = data['rank'].iloc[:n_train]
+        self.__X_test = features.iloc[n_train:]
+        self.__y_test = data['rank'].iloc[n_train:]
+        # 説明変数は一度だけfloat32の連続した配列に変換し、学習には行の範囲で切り出して使う
+        self.__matrix = _to_matrix(features)
+        self.__labels = data['rank'].to_numpy()
+        self.__n_train = n_train
+        self.__n_train_optuna = n_train_optuna
+        # optuna用のデータセットと、そのフィンガープリントは、使う時に作る
+        self.__lgb_train_optuna = None
+        self.__lgb_valid_optuna = None
+        self.__fingerprint = None
+
+    def __split_point(self, index, n_rows, test_size):
+        """
+        時系列に沿って訓練データとテストデータに分ける位置。test_sizeは0~1。
+        レースの途中では分けない。
+        """
+        race_ids = index.unique()
+        n_train_races = round(len(race_ids) * (1 - test_size))
+        if n_train_races >= len(race_ids):
+            return n_rows
+        return int(np.argmax(index == race_ids[n_train_races]))
+
+    def __load_lgb_datasets(self):
+        """
+        optuna用の訓練データ・検証データのLightGBMデータセット。
+        データの内容から計算したフィンガープリントをファイル名にして、バイナリ形式で保存・再利用する。
+        """
+        train_path, valid_path = self.__dataset_paths()
+        if os.path.isfile(train_path) and os.path.isfile(valid_path):
+            train = lgb_o.Dataset(train_path, params=self.LGB_DATASET_PARAMS)
+            valid = lgb_o.Dataset(valid_path, reference=train, params=self.LGB_DATASET_PARAMS)
+            return train, valid
+        train = lgb_o.Dataset(
+            self.__matrix[:self.__n_train_optuna],
+            self.__labels[:self.__n_train_optuna],
+            params=self.LGB_DATASET_PARAMS,
+            free_raw_data=False
+            )
+        valid = lgb_o.Dataset(
+            self.__matrix[self.__n_train_optuna:self.__n_train],
+            self.__labels[self.__n_train_optuna:self.__n_train],
+            reference=train,
+            params=self.LGB_DATASET_PARAMS,
+            free_raw_data=False
+            )
+        os.makedirs(self.__dataset_dir, exist_ok=True)
+        # 他のプロセスが書き込み途中のファイルを読まないよう、一時ファイルから置き換える
+        for dataset, path in [(train, train_path), (valid, valid_path)]:
+            dataset.construct().save_binary(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        return train, valid
+
+    def __dataset_paths(self) -> tuple:
+        return tuple(
+            os.path.join(self.__dataset_dir, '{}_{}.bin'.format(self.fingerprint, name)) for name in ['train', 'valid']
+            )
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        optuna用のデータセットの内容を表すハッシュ値
         """
-        self.__train_data, self.__test_data = self.__split_by_date(self.__featured_data, test_size=test_size)
-        self.__train_data_optuna, self.__valid_data_optuna = self.__split_by_date(
-            self.__train_data, test_size=valid_size
-        )
-        self.__lgb_train_optuna = lgb_o.Dataset(
-            self.__train_data_optuna.drop(['rank', 'date', ResultsCols.TANSHO_ODDS], axis=1).values,
-            self.__train_data_optuna['rank']
-        )
-        self.__lgb_valid_optuna = lgb_o.Dataset(
-            self.__valid_data_optuna.drop(['rank', 'date', ResultsCols.TANSHO_ODDS], axis=1).values,
-            self.__valid_data_optuna['rank']
-        )
-        # 説明変数と目的変数に分ける。開催はエラーなるので一度drop。
-        self.__X_train = self.__train_data.drop(['rank', 'date', ResultsCols.TANSHO_ODDS], axis=1)
-        self.__y_train = self.__train_data['rank']
-        self.__X_test = self.__test_data.drop(['rank', 'date', ResultsCols.TANSHO_ODDS], axis=1)
-        self.__y_test = self.__test_data['rank']
-
-    def __split_by_date(self, df, test_size):
-        """
-        時系列に沿って訓練データとテストデータに分ける関数。test_sizeは0~1。
-        """
-        sorted_id_list = df.sort_values("date").index.unique()
-        train_id_list = sorted_id_list[: round(len(sorted_id_list) * (1 - test_size))]
-        test_id_list = sorted_id_list[round(len(sorted_id_list) * (1 - test_size)) :]
-        train = df.loc[train_id_list]
-        test = df.loc[test_id_list]
-        return train, test
+        if self.__fingerprint is None:
+            self.__fingerprint = self.__calc_fingerprint()
+        return self.__fingerprint
+
+    @property
+    def lgb_dataset_paths(self) -> tuple:
+        """
+        optuna用の訓練データ・検証データのバイナリファイルのパス。まだなければ作る。
+        別のプロセスでデータセットを読み込む時に使う。
+        """
+        paths = self.__dataset_paths()
+        if not all(os.path.isfile(path) for path in paths):
+            self.__lgb_train_optuna, self.__lgb_valid_optuna = self.__load_lgb_datasets()
+        return paths
+
+    @property
+    def dataset_dir(self) -> str:
+        return self.__dataset_dir
+
+    def __calc_fingerprint(self) -> str:
+        sha1 = hashlib.sha1()
+        sha1.update(self.__matrix[:self.__n_train].tobytes())
+        sha1.update(self.__labels[:self.__n_train].astype(np.float32).tobytes())
+        sha1.update(repr((
+            self.__X_train.columns.tolist(), self.__n_train_optuna, self.LGB_DATASET_PARAMS, lightgbm.__version__
+            )).encode())
+        return sha1.hexdigest()
 
     @property
     def featured_data(self):
@@ -63,10 +171,14 @@ class DataSplitter:
 
     @property
     def lgb_train_optuna(self):
+        if self.__lgb_train_optuna is None:
+            self.__lgb_train_optuna, self.__lgb_valid_optuna = self.__load_lgb_datasets()
         return self.__lgb_train_optuna
 
     @property
     def lgb_valid_optuna(self):
+        if self.__lgb_valid_optuna is None:
+            self.__lgb_train_optuna, self.__lgb_valid_optuna = self.__load_lgb_datasets()
         return self.__lgb_valid_optuna
 
     @property
@@ -85,6 +197,20 @@ class DataSplitter:
     def y_test(self):
         return self.__y_test
 
+    @property
+    def X_train_matrix(self):
+        """
+        X_trainと同じ行・列のfloat32の配列
+        """
+        return self.__matrix[:self.__n_train]
+
+    @property
+    def X_test_matrix(self):
+        """
+        X_testと同じ行・列のfloat32の配列
+        """
+        return self.__matrix[self.__n_train:]
+
     @property
     def tansho_odds_test(self):
         return self.__test_data[ResultsCols.TANSHO_ODDS]
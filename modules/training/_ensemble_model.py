@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+from ._data_splitter import DataSplitter, _to_matrix
+
+
+# 並列処理時に、各プロセスが読み取り専用で共有する訓練データ
+_shared_matrix = None
+_shared_labels = None
+
+def _init_worker(matrix_path: str, labels: np.ndarray):
+    global _shared_matrix, _shared_labels
+    # 説明変数はメモリマップで開き、プロセスごとにコピーしない
+    _shared_matrix = np.load(matrix_path, mmap_mode='r')
+    _shared_labels = labels
+
+def _fit_member(params: dict) -> str:
+    model = lgb.LGBMClassifier(**params)
+    model.fit(_shared_matrix, _shared_labels)
+    return model.booster_.model_to_string()
+
+
+class EnsembleModel:
+    """
+    乱数シードやバギングを変えて学習した複数のモデルの、predict_probaの平均を返すクラス。
+    LGBMClassifierと同じくpredict_probaを持つので、score_policyにそのまま渡せる。
+    """
+    # ハイパーパラメータのうち、LightGBMで本来の名前の方が優先される別名
+    PARAM_ALIASES = {
+        'bagging_fraction': ['subsample', 'sub_row', 'bagging'],
+        'feature_fraction': ['colsample_bytree', 'sub_feature'],
+        'bagging_freq': ['subsample_freq'],
+        }
+
+    def __init__(self, boosters: list, feature_names: list = None, params: dict = None):
+        """
+        feature_namesは学習時の説明変数の列名。指定した場合、predict_probaではその列を順に使う。
+        """
+        self.__boosters = boosters
+        self.__feature_names = feature_names
+        self.__params = params
+
+    @classmethod
+    def train(
+        cls,
+        datasets: DataSplitter,
+        params: dict = {},
+        n_models: int = 5,
+        bagging_fraction: float = 0.8,
+        feature_fraction: float = 0.8,
+        n_jobs: int = -1
+        ) -> 'EnsembleModel':
+        """
+        paramsを元に、random_stateだけを変えたn_models個のモデルを複数プロセスで学習する。
+        bagging_fraction・feature_fractionが1の場合は、乱数の影響がほとんどないので、
+        モデルごとの違いは小さくなる。paramsにチューニング済みのbagging_fractionなどがあっても、
+        引数の値で上書きする。
+        各プロセスのLightGBMのスレッド数は、コア数をプロセス数で割ったものにする。
+        """
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        n_jobs = min(n_jobs, n_models)
+        seed = params.get('random_state') or 0
+        # 別名で指定すると、paramsにある本来の名前の値が優先されて無視されるので、本来の名前で指定する
+        base_params = {
+            k: v for k, v in params.items() if k not in sum(cls.PARAM_ALIASES.values(), [])
+            }
+        base_params.update(
+            bagging_fraction=bagging_fraction,
+            bagging_freq=1 if bagging_fraction < 1 else 0,
+            feature_fraction=feature_fraction,
+            n_jobs=max(1, os.cpu_count() // n_jobs),
+            )
+        member_params = [dict(base_params, random_state=seed + i) for i in range(n_models)]
+        matrix_path = cls.__save_matrix(datasets)
+        labels = datasets.y_train.to_numpy()
+        if n_jobs == 1:
+            _init_worker(matrix_path, labels)
+            model_strs = [_fit_member(p) for p in member_params]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=_init_worker, initargs=(matrix_path, labels)
+                ) as executor:
+                model_strs = list(executor.map(_fit_member, member_params))
+        return cls(
+            [lgb.Booster(model_str=model_str) for model_str in model_strs],
+            datasets.X_train.columns.tolist(),
+            dict(base_params, random_state=seed),
+            )
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        各モデルの予測値の平均。学習時と同じく、Categorical型の列はカテゴリの値を使う。
+        """
+        if isinstance(X, pd.DataFrame):
+            if self.__feature_names is not None:
+                X = X[self.__feature_names]
+            X = _to_matrix(X)
+        score = np.mean([booster.predict(X) for booster in self.__boosters], axis=0)
+        return np.column_stack([1 - score, score])
+
+    @property
+    def boosters(self) -> list:
+        return self.__boosters
+
+    @property
+    def feature_names(self) -> list:
+        return self.__feature_names
+
+    @property
+    def params(self) -> dict:
+        """
+        各モデルの学習に使ったハイパーパラメータ(random_stateは1つ目のモデルのもの)
+        """
+        return self.__params
+
+    @staticmethod
+    def __save_matrix(datasets: DataSplitter) -> str:
+        """
+        訓練データの説明変数を、各プロセスからメモリマップで開けるように保存する。
+        同じデータセットなら保存済みのものを使う。
+        """
+        matrix_path = os.path.join(datasets.dataset_dir, '{}_X_train.npy'.format(datasets.fingerprint))
+        if not os.path.isfile(matrix_path):
+            os.makedirs(datasets.dataset_dir, exist_ok=True)
+            with open(matrix_path + '.tmp', 'wb') as f:
+                np.save(f, np.ascontiguousarray(datasets.X_train_matrix))
+            os.replace(matrix_path + '.tmp', matrix_path)
+        return matrix_path
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+from sklearn.metrics import roc_auc_score
+
+from ._data_splitter import DataSplitter
+from modules.constants import ResultsCols
+from modules.preprocessing import FeatureSpec
+
+
+class FeatureSelector:
+    """
+    特徴量の重要度(gain)が低いものから順に除いていき、検証データのAUCが
+    許容範囲内で下がらない特徴量の一覧(FeatureSpec)を作るクラス。
+    学習・評価には、DataSplitterのoptuna用の訓練データと検証データを使う。
+    """
+    def __init__(
+        self,
+        datasets: DataSplitter,
+        params: dict = {},
+        protected_cols: list = [ResultsCols.UMABAN]
+        ):
+        """
+        paramsはLGBMClassifierのハイパーパラメータ。
+        protected_colsは、重要度に関わらず残す列(スコアの計算に使う馬番など)。
+        """
+        self.__feature_names = np.array(datasets.X_train.columns)
+        self.__protected = np.isin(self.__feature_names, protected_cols)
+        n_train_optuna = len(datasets.train_data_optuna)
+        self.__X_train = datasets.X_train_matrix[:n_train_optuna]
+        self.__y_train = datasets.y_train.values[:n_train_optuna]
+        self.__X_valid = datasets.X_train_matrix[n_train_optuna:]
+        self.__y_valid = datasets.y_train.values[n_train_optuna:]
+        self.__params = dict(params)
+        self.__history = []
+
+    def select(self, auc_tolerance: float = 0.002, drop_ratio: float = 0.2, min_features: int = 10) -> FeatureSpec:
+        """
+        残っている特徴量の重要度が低い方からdrop_ratioの割合を除いて学習し直すことを繰り返す。
+        重要度が0の特徴量は、割合に関わらず全て除く。
+        AUCが全特徴量の場合よりauc_toleranceを超えて下がったら、除く数を半分にしてやり直し、
+        1つも除けなくなるか、min_featuresまで減ったら終わる。
+        """
+        selected = np.arange(len(self.__feature_names))
+        base_auc, gain = self.__fit(selected)
+        self.__record(selected, base_auc)
+        n_drop = None
+        while len(selected) > min_features:
+            # 保護する列以外を、重要度の低い順に並べる
+            order = np.argsort(gain, kind='stable')
+            candidates = order[~self.__protected[selected[order]]]
+            if n_drop is None:
+                n_drop = max(int((gain[candidates] == 0).sum()), int(len(selected) * drop_ratio), 1)
+            n_drop = min(n_drop, len(candidates), len(selected) - min_features)
+            if n_drop <= 0:
+                break
+            trial = np.sort(np.setdiff1d(selected, selected[candidates[:n_drop]]))
+            auc, trial_gain = self.__fit(trial)
+            self.__record(trial, auc)
+            if auc < base_auc - auc_tolerance:
+                # 除きすぎたので、除く数を減らす
+                if n_drop == 1:
+                    break
+                n_drop //= 2
+                continue
+            selected, gain = trial, trial_gain
+            n_drop = None
+        print('{} -> {} features'.format(len(self.__feature_names), len(selected)))
+        return FeatureSpec(tuple(self.__feature_names[selected]), tuple(DataSplitter.NON_FEATURE_COLS))
+
+    @property
+    def history(self) -> pd.DataFrame:
+        """
+        試した特徴量の数と、検証データのAUC
+        """
+        return pd.DataFrame(self.__history)
+
+    def __fit(self, selected: np.ndarray) -> tuple:
+        """
+        selectedの列だけで学習し、検証データのAUCと各列の重要度(gain)を返す
+        """
+        model = lgb.LGBMClassifier(objective='binary', importance_type='gain', **self.__params)
+        model.fit(self.__X_train[:, selected], self.__y_train)
+        auc = roc_auc_score(self.__y_valid, model.predict_proba(self.__X_valid[:, selected])[:, 1])
+        return auc, model.feature_importances_
+
+    def __record(self, selected: np.ndarray, auc: float):
+        print('{} features: AUC {:.4f}'.format(len(selected), auc))
+        self.__history.append({'n_features': len(selected), 'auc': auc})
@@ -8,19 +8,36 @@ class KeibaAI:
     """
     モデルの訓練や読み込み、実際に賭けるなどの処理を実行するクラス。
     """
-    def __init__(self, datasets: DataSplitter):
+    def __init__(self, datasets: DataSplitter, model_wrapper: ModelWrapper = None):
+        """
+        予測だけに使う場合(KeibaAIFactory.load_artifact)は、datasetsはNoneで、
+        学習済みのmodel_wrapperを渡す。
+        """
         self.__datasets = datasets
-        self.__model_wrapper = ModelWrapper()
+        self.__model_wrapper = model_wrapper if model_wrapper is not None else ModelWrapper()
 
     @property
     def datasets(self):
         return self.__datasets
 
-    def train_with_tuning(self):
+    @property
+    def lgb_model(self):
+        return self.__model_wrapper.lgb_model
+
+    @property
+    def model(self):
+        """
+        スコアの計算に使うモデル。学習済みの場合はEnsembleModel(1つのモデルのみの場合を含む)、
+        load_artifactで読み込んだ場合はModelArtifact
+        """
+        return self.__model_wrapper.model
+
+    def train_with_tuning(self, **tuning_params):
         """
         optunaでのチューニング後、訓練させる。
+        tuning_paramsにはn_trials, n_jobsなど、ModelWrapper.tune_hyper_paramsの引数を入れる。
         """
-        self.__model_wrapper.tune_hyper_params(self.__datasets)
+        self.__model_wrapper.tune_hyper_params(self.__datasets, **tuning_params)
         self.__model_wrapper.train(self.__datasets)
 
     def train_without_tuning(self):
@@ -29,6 +46,25 @@ class KeibaAI:
         """
         self.__model_wrapper.train(self.__datasets)
 
+    def train_ensemble(self, **ensemble_params):
+        """
+        乱数シードやバギングを変えた複数のモデルを並列に学習し、以降のスコアはその平均から計算する。
+        ensemble_paramsにはn_models, n_jobsなど、EnsembleModel.trainの引数を入れる。
+        """
+        self.__model_wrapper.train_ensemble(self.__datasets, **ensemble_params)
+
+    def train_incremental(self, datasets: DataSplitter, **incremental_params) -> dict:
+        """
+        新しいレースを追加したdatasetsで、前回のモデルの続きから学習させる。
+        incremental_paramsにはnum_boost_round, max_updatesなど、ModelWrapper.train_incrementalの引数を入れる。
+        """
+        self.__datasets = datasets
+        return self.__model_wrapper.train_incremental(datasets, **incremental_params)
+
+    @property
+    def auc_history(self) -> pd.DataFrame:
+        return self.__model_wrapper.auc_history
+
     def get_params(self):
         """
         ハイパーパラメータを取得
@@ -48,7 +84,7 @@ class KeibaAI:
         """
         score_policyを元に、馬の「勝ちやすさスコア」を計算する。
         """
-        return score_policy.calc(self.__model_wrapper.lgb_model, X)
+        return score_policy.calc(self.__model_wrapper.model, X)
 
     def decide_action(self, score_table: pd.DataFrame,
         bet_policy: AbstractBetPolicy, **params) -> dict:
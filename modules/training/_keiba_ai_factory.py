@@ -1,8 +1,13 @@
 import datetime
 import os
 import dill
+import numpy as np
 from ._keiba_ai import KeibaAI
 from ._data_splitter import DataSplitter
+from ._model_artifact import ModelArtifact
+from ._model_wrapper import ModelWrapper
+from modules.constants import ResultsCols
+from modules.preprocessing import DtypeOptimizer, FeatureStoreQuery
 
 
 class KeibaAIFactory:
@@ -10,7 +15,18 @@ class KeibaAIFactory:
     KeibaAIのインスタンスを作成するためのクラス
     """
     @staticmethod
-    def create(featured_data, test_size = 0.3, valid_size = 0.3) -> KeibaAI:
+    def create(featured_data, test_size = 0.3, valid_size = 0.3, optimize_dtypes = True) -> KeibaAI:
+        """
+        featured_dataには、FeatureEngineering.featured_dataか、FeatureStoreQueryを渡す。
+        optimize_dtypes=Trueの場合、DtypeOptimizerで数値の列のdtypeを小さくしてから分割する。
+        文字列の列はCategorical型にしないので、学習結果は変換しない場合と同じになる。
+        """
+        if isinstance(featured_data, FeatureStoreQuery):
+            # DataSplitterで使う列は、columnsの指定に関わらず読み込む
+            featured_data = featured_data.read(required_cols=['rank', 'date', ResultsCols.TANSHO_ODDS])
+        if optimize_dtypes:
+            # 払い戻しの計算に使うオッズはそのままにする
+            featured_data = DtypeOptimizer(exclude_cols=[ResultsCols.TANSHO_ODDS]).transform(featured_data)
         datasets = DataSplitter(featured_data, test_size, valid_size)
         return KeibaAI(datasets)
 
@@ -31,3 +47,43 @@ class KeibaAIFactory:
     def load(filepath: str) -> KeibaAI:
         with open(filepath, mode='rb') as f:
             return dill.load(f)
+
+    @staticmethod
+    def save_artifact(keibaAI: KeibaAI, version_name: str, dataset_ref: dict = None) -> str:
+        """
+        予測に必要なものだけを、ModelArtifactとして保存する。学習データは含まない。
+        train_ensembleで学習した場合は、予測に使うアンサンブルの全てのモデルを保存する。
+        保存先はmodels/(yyyymmdd)/(version_name)/で、保存先のパスを返す。
+        dataset_refを指定しない場合は、DataSplitterのフィンガープリントと期間を記録する。
+        保存後に読み込み直し、テストデータの先頭で予測がメモリ上のモデルと一致しない場合はValueErrorにする。
+        """
+        datasets = keibaAI.datasets
+        if dataset_ref is None:
+            dataset_ref = {
+                'fingerprint': datasets.fingerprint,
+                'train_start': str(datasets.train_data['date'].min()),
+                'test_end': str(datasets.test_data['date'].max()),
+                }
+        artifact = ModelArtifact.from_model(keibaAI.model, datasets.X_train, dataset_ref)
+        yyyymmdd = datetime.date.today().strftime('%Y%m%d')
+        dirpath = os.path.join('models', yyyymmdd, version_name)
+        artifact.save(dirpath)
+        # 読み込んだモデルが、メモリ上のモデルと同じスコアを返すことを確認する
+        X_check = datasets.X_test.iloc[:1000]
+        expected = keibaAI.model.predict_proba(X_check)[:, 1]
+        actual = ModelArtifact.load(dirpath).predict_proba(X_check)[:, 1]
+        if not np.allclose(actual, expected, rtol=1e-6, atol=1e-9):
+            raise ValueError('saved model predicts differently: max diff {:.3g} ({})'.format(
+                np.abs(actual - expected).max(), dirpath
+                ))
+        return dirpath
+
+    @staticmethod
+    def load_artifact(dirpath: str) -> KeibaAI:
+        """
+        save_artifactで保存したモデルを、予測専用のKeibaAIとして読み込む。
+        datasetsはNoneなので、学習やチューニングはできない。
+        """
+        model_wrapper = ModelWrapper()
+        model_wrapper.lgb_model = ModelArtifact.load(dirpath)
+        return KeibaAI(None, model_wrapper)
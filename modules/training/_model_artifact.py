@@ -0,0 +1,136 @@
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+from ._data_splitter import _to_matrix
+from ._ensemble_model import EnsembleModel
+from modules.preprocessing import IdMaster
+
+
+class ModelArtifact:
+    """
+    予測に必要なものだけを保存したモデル。
+    - model.txt: LightGBMのブースター(テキスト形式)。アンサンブルの場合はmodel_0.txt, model_1.txt, ...
+    - meta.json: 特徴量の列名とdtype、ハイパーパラメータ、IdMasterの対応表のバージョン、学習データの参照、モデルの数
+    学習データは含まないので、数MBで読み込みも速い。
+    predict_probaを持つので、KeibaAI.calc_scoreのモデルとしてそのまま使える。
+    """
+    def __init__(
+        self,
+        boosters: list,
+        feature_names: list,
+        dtypes: dict,
+        params: dict,
+        id_versions: dict,
+        dataset_ref: dict = None
+        ):
+        self.__boosters = boosters
+        self.__feature_names = feature_names
+        self.__dtypes = dtypes
+        self.__params = params
+        self.__id_versions = id_versions
+        self.__dataset_ref = dataset_ref
+
+    @classmethod
+    def from_model(cls, model, X_train: pd.DataFrame, dataset_ref: dict = None):
+        """
+        学習済みのモデル(LGBMClassifierかEnsembleModel)と、学習に使った説明変数から作る。
+        EnsembleModelの場合は、全てのモデルを保存する。
+        """
+        if isinstance(model, EnsembleModel):
+            boosters, params = model.boosters, model.params or {}
+        else:
+            boosters, params = [model.booster_], model.get_params()
+        return cls(
+            boosters=boosters,
+            feature_names=X_train.columns.tolist(),
+            dtypes={col: str(dtype) for col, dtype in X_train.dtypes.items()},
+            params={k: v for k, v in params.items() if v is None or isinstance(v, (int, float, str, bool))},
+            id_versions=IdMaster().versions(),
+            dataset_ref=dataset_ref,
+            )
+
+    def save(self, dirpath: str):
+        os.makedirs(dirpath, exist_ok=True)
+        for filename, booster in zip(self.__model_files(len(self.__boosters)), self.__boosters):
+            booster.save_model(os.path.join(dirpath, filename))
+        meta = {
+            'n_models': len(self.__boosters),
+            'feature_names': self.__feature_names,
+            'dtypes': self.__dtypes,
+            'params': self.__params,
+            'id_versions': self.__id_versions,
+            'dataset_ref': self.__dataset_ref,
+            'lightgbm_version': lgb.__version__,
+            'saved_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            }
+        with open(os.path.join(dirpath, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, dirpath: str) -> 'ModelArtifact':
+        with open(os.path.join(dirpath, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        boosters = [
+            lgb.Booster(model_file=os.path.join(dirpath, filename))
+            for filename in cls.__model_files(meta.get('n_models', 1))
+            ]
+        # 予測時の対応表が学習時より古いと、学習時にあったIDが欠損値になる
+        current_versions = IdMaster().versions()
+        older = [
+            table for table, n_ids in meta['id_versions'].items() if current_versions.get(table, 0) < n_ids
+            ]
+        if len(older) > 0:
+            print('warning: IdMaster is older than the one used for training: {}'.format(older))
+        return cls(
+            boosters, meta['feature_names'], meta['dtypes'], meta['params'], meta['id_versions'], meta['dataset_ref']
+            )
+
+    def predict_proba(self, X: pd.DataFrame) -> np.ndarray:
+        """
+        LGBMClassifier.predict_probaと同じ形式で返す。アンサンブルの場合は各モデルの平均。
+        学習時と同じく、Categorical型の列はカテゴリの値を使う。
+        """
+        X = _to_matrix(X[self.__feature_names])
+        score = np.mean([booster.predict(X) for booster in self.__boosters], axis=0)
+        return np.column_stack([1 - score, score])
+
+    @property
+    def boosters(self):
+        return self.__boosters
+
+    @property
+    def feature_names(self):
+        return self.__feature_names
+
+    @property
+    def dtypes(self):
+        return self.__dtypes
+
+    @property
+    def params(self):
+        return self.__params
+
+    @property
+    def id_versions(self):
+        return self.__id_versions
+
+    @property
+    def dataset_ref(self):
+        return self.__dataset_ref
+
+    @property
+    def feature_importance(self):
+        return pd.DataFrame({
+            'features': self.__feature_names,
+            'importance': np.mean([booster.feature_importance() for booster in self.__boosters], axis=0)
+            }).sort_values('importance', ascending=False)
+
+    @staticmethod
+    def __model_files(n_models: int) -> list:
+        if n_models == 1:
+            return ['model.txt']
+        return ['model_{}.txt'.format(i) for i in range(n_models)]
@@ -1,12 +1,69 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from sklearn.metrics import roc_auc_score
-import optuna.integration.lightgbm as lgb_o
+import optuna
+from optuna_integration import LightGBMPruningCallback
 from lightgbm import early_stopping
-from lightgbm import log_evaluation
 from ._data_splitter import DataSplitter
+from ._ensemble_model import EnsembleModel
+from modules.constants import LocalPaths
 import lightgbm as lgb
 
 
+def _objective(trial: optuna.Trial, train_path: str, valid_path: str, num_threads: int) -> float:
+    """
+    1回の試行。検証データのloglossを返す。
+    """
+    params = {
+        'objective': 'binary',
+        'metric': 'binary_logloss',
+        'verbosity': -1,
+        'num_threads': num_threads,
+        'feature_pre_filter': False,
+        'lambda_l1': trial.suggest_float('lambda_l1', 1e-8, 10.0, log=True),
+        'lambda_l2': trial.suggest_float('lambda_l2', 1e-8, 10.0, log=True),
+        'num_leaves': trial.suggest_int('num_leaves', 2, 256),
+        'feature_fraction': trial.suggest_float('feature_fraction', 0.4, 1.0),
+        'bagging_fraction': trial.suggest_float('bagging_fraction', 0.4, 1.0),
+        'bagging_freq': trial.suggest_int('bagging_freq', 1, 7),
+        'min_child_samples': trial.suggest_int('min_child_samples', 5, 100),
+        }
+    train = lgb.Dataset(train_path, params=DataSplitter.LGB_DATASET_PARAMS)
+    valid = lgb.Dataset(valid_path, reference=train, params=DataSplitter.LGB_DATASET_PARAMS)
+    booster = lgb.train(
+        params,
+        train,
+        num_boost_round=1000,
+        valid_sets=[valid],
+        valid_names=['valid'],
+        # 見込みのない試行は、検証データのloglossを見て途中で打ち切る
+        callbacks=[early_stopping(10, verbose=False), LightGBMPruningCallback(trial, 'binary_logloss', 'valid')],
+        )
+    return booster.best_score['valid']['binary_logloss']
+
+def _storage(db_path: str) -> optuna.storages.RDBStorage:
+    # 複数プロセスから書き込むので、ロックの待ち時間を長めにする
+    return optuna.storages.RDBStorage(
+        'sqlite:///{}'.format(db_path), engine_kwargs={'connect_args': {'timeout': 60}}
+        )
+
+def _pruner() -> optuna.pruners.BasePruner:
+    # 枝刈りの設定はstorageに保存されないので、studyを開く度に同じものを渡す
+    return optuna.pruners.MedianPruner(n_warmup_steps=10)
+
+def _optimize(args):
+    """
+    1つのプロセスでの最適化。studyはSQLiteを通して他のプロセスと共有する。
+    """
+    study_name, db_path, n_trials, train_path, valid_path, num_threads = args
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.load_study(study_name=study_name, storage=_storage(db_path), pruner=_pruner())
+    # n_trialsはこのプロセスの割り当て分
+    study.optimize(lambda trial: _objective(trial, train_path, valid_path, num_threads), n_trials=n_trials)
+
+
 class ModelWrapper:
     """
     モデルのハイパーパラメータチューニング・学習の処理が記述されたクラス。
@@ -14,28 +71,68 @@ class ModelWrapper:
     def __init__(self):
         self.__lgb_model = lgb.LGBMClassifier(objective='binary')
         self.__feature_importance = None
+        # 複数モデルのアンサンブル。学習した場合は、予測にはこちらを使う
+        self.__ensemble = None
+        # 差分学習用の、直近の学習の状態
+        self.__feature_names = None
+        self.__train_end_date = None
+        self.__n_base_rows = 0
+        self.__n_updates = 0
+        self.__base_auc = None
+        self.__auc_history = []
 
-    def tune_hyper_params(self, datasets: DataSplitter):
+    def tune_hyper_params(
+        self,
+        datasets: DataSplitter,
+        n_trials: int = 100,
+        n_jobs: int = 1,
+        study_name: str = None,
+        db_path: str = LocalPaths.OPTUNA_DB_PATH
+        ):
         """
         optunaによるチューニングを実行。
+        試行の記録はdb_pathのSQLiteに保存されるので、中断しても同じstudy_nameで再開できる。
+        n_trialsはstudy全体での試行数で、再開した場合は完了・打ち切りになった試行数との差だけ試行する。
+        study_nameを指定しない場合は、データセットのフィンガープリントから決める。
+        n_jobsに2以上(-1で全コア)を指定すると、複数プロセスで試行する。
+        各プロセスのLightGBMのスレッド数は、コア数をプロセス数で割ったものにする。
         """
-
-        params = {'objective': 'binary'}
-
-        # チューニング実行
-        lgb_clf_o = lgb_o.train(
-            params,
-            datasets.lgb_train_optuna,
-            valid_sets=(datasets.lgb_train_optuna, datasets.lgb_valid_optuna),
-            callbacks=[early_stopping(10), log_evaluation(100)],
-        )
-
-        # num_iterationsとearly_stopping_roundは今は使わないので削除
-        tunedParams = {
-            k: v for k, v in lgb_clf_o.params.items() if k not in ['num_iterations', 'early_stopping_round']
-            }
-
-        self.__lgb_model.set_params(**tunedParams)
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if study_name is None:
+            study_name = 'keiba_ai_{}'.format(datasets.fingerprint[:16])
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        storage = _storage(db_path)
+        study = optuna.create_study(
+            study_name=study_name,
+            storage=storage,
+            direction='minimize',
+            pruner=_pruner(),
+            load_if_exists=True,
+            )
+        # 再開した場合は、完了・打ち切りになった試行を除いた残りだけを、各プロセスに割り振る
+        n_done = len(study.get_trials(
+            deepcopy=False, states=(optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+            ))
+        n_remaining = n_trials - n_done
+        if n_remaining > 0:
+            n_jobs = min(n_jobs, n_remaining)
+            train_path, valid_path = datasets.lgb_dataset_paths
+            args_list = [
+                (study_name, db_path, n_remaining // n_jobs + (i < n_remaining % n_jobs),
+                 train_path, valid_path, max(1, os.cpu_count() // n_jobs))
+                for i in range(n_jobs)
+                ]
+            if n_jobs == 1:
+                _optimize(args_list[0])
+            else:
+                with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                    list(executor.map(_optimize, args_list))
+            study = optuna.load_study(study_name=study_name, storage=storage)
+        else:
+            print('study {} already has {} finished trials'.format(study_name, n_done))
+        print('best binary_logloss: {:.5f} ({} trials)'.format(study.best_value, len(study.trials)))
+        self.__lgb_model.set_params(**study.best_params)
 
     @property
     def params(self):
@@ -49,21 +146,137 @@ class ModelWrapper:
 
     def train(self, datasets: DataSplitter):
         # 学習
-        self.__lgb_model.fit(datasets.X_train.values, datasets.y_train.values)
-        # AUCを計算して出力
+        self.__lgb_model.fit(datasets.X_train_matrix, datasets.y_train.values)
+        self.__ensemble = None
+        # AUCを計算して出力。学習時と同じく、Categorical型の列はカテゴリの値で予測する
         auc_train = roc_auc_score(
-            datasets.y_train, self.__lgb_model.predict_proba(datasets.X_train)[:, 1]
+            datasets.y_train, self.__lgb_model.predict_proba(datasets.X_train_matrix)[:, 1]
             )
-        auc_test = roc_auc_score(
-            datasets.y_test,
-            self.__lgb_model.predict_proba(datasets.X_test)[:, 1]
+        auc_test = self.__auc_test(datasets)
+        self.__update_feature_importance(datasets)
+        print('AUC: {:.3f}(train), {:.3f}(test)'.format(auc_train, auc_test))
+        # 差分学習の基準にする
+        self.__feature_names = datasets.X_train.columns.tolist()
+        self.__train_end_date = datasets.train_data['date'].max()
+        self.__n_base_rows = len(datasets.X_train)
+        self.__n_updates = 0
+        self.__base_auc = auc_test
+        self.__auc_history.append({
+            'mode': 'full', 'train_end_date': self.__train_end_date, 'n_rows': self.__n_base_rows,
+            'auc_before': None, 'auc_test': auc_test, 'auc_drift': 0.0, 'reason': None
+            })
+
+    def train_incremental(
+        self,
+        datasets: DataSplitter,
+        num_boost_round: int = 50,
+        max_updates: int = 4,
+        max_new_ratio: float = 0.2,
+        max_auc_drop: float = 0.01
+        ) -> dict:
+        """
+        前回の学習以降に追加された訓練データだけで、前回のブースターの続きからnum_boost_round本の木を学習する。
+        次のいずれかの場合は、差分学習をせずに全データで学習し直す。
+        - まだ全データでの学習をしていない、または説明変数の列が変わった
+        - 前回の全データでの学習から、差分学習をmax_updates回行った
+        - 追加されたデータの行数が、前回の全データでの学習の行数のmax_new_ratio倍を超える
+        - 差分学習後のテストデータのAUCが、前回の全データでの学習時よりmax_auc_drop以上下がった
+        学習前後と全データでの学習時のテストデータのAUCを出力し、auc_historyに記録する。
+        """
+        reason = self.__full_retrain_reason(datasets, max_updates, max_new_ratio)
+        if reason is not None:
+            print('full retrain: {}'.format(reason))
+            self.train(datasets)
+            self.__auc_history[-1]['reason'] = reason
+            return self.__auc_history[-1]
+
+        is_new = (datasets.train_data['date'] > self.__train_end_date).to_numpy()
+        if not is_new.any():
+            print('no new training data after {}'.format(self.__train_end_date.date()))
+            return self.__auc_history[-1]
+        auc_before = self.__auc_test(datasets)
+        # 前回のブースターを初期値にして、追加分の木だけを学習する
+        params = self.__lgb_model.get_params()
+        model = lgb.LGBMClassifier(**dict(params, n_estimators=num_boost_round))
+        model.fit(
+            datasets.X_train_matrix[is_new],
+            datasets.y_train.values[is_new],
+            init_model=self.__lgb_model.booster_
             )
+        # チューニングや全データでの学習では、元の木の本数を使う
+        model.set_params(n_estimators=params['n_estimators'])
+        previous_model = self.__lgb_model
+        self.__lgb_model = model
+        self.__ensemble = None
+        auc_test = self.__auc_test(datasets)
+        drift = auc_test - self.__base_auc
+        print('AUC(test): {:.3f}(before) -> {:.3f}(after), drift from full retrain: {:+.3f}'.format(
+            auc_before, auc_test, drift
+            ))
+        if drift < -max_auc_drop:
+            reason = 'AUC dropped by {:.3f}'.format(-drift)
+            print('full retrain: {}'.format(reason))
+            self.__lgb_model = previous_model
+            self.train(datasets)
+            self.__auc_history[-1]['reason'] = reason
+            return self.__auc_history[-1]
+
+        self.__update_feature_importance(datasets)
+        self.__train_end_date = datasets.train_data['date'].max()
+        self.__n_updates += 1
+        self.__auc_history.append({
+            'mode': 'incremental', 'train_end_date': self.__train_end_date, 'n_rows': int(is_new.sum()),
+            'auc_before': auc_before, 'auc_test': auc_test, 'auc_drift': drift, 'reason': None
+            })
+        return self.__auc_history[-1]
+
+    def train_ensemble(self, datasets: DataSplitter, **ensemble_params):
+        """
+        現在のハイパーパラメータで、乱数シードやバギングを変えた複数のモデルを並列に学習する。
+        ensemble_paramsにはn_models, bagging_fractionなど、EnsembleModel.trainの引数を入れる。
+        以降の予測(model)は、各モデルのpredict_probaの平均になる。
+        """
+        self.__ensemble = EnsembleModel.train(datasets, self.__lgb_model.get_params(), **ensemble_params)
+        member_aucs = [
+            roc_auc_score(datasets.y_test, booster.predict(datasets.X_test_matrix))
+            for booster in self.__ensemble.boosters
+            ]
+        print('AUC(test): {:.3f}(ensemble), {:.3f}±{:.3f}({} models)'.format(
+            roc_auc_score(datasets.y_test, self.__ensemble.predict_proba(datasets.X_test_matrix)[:, 1]),
+            np.mean(member_aucs), np.std(member_aucs), len(member_aucs)
+            ))
+
+    def __full_retrain_reason(self, datasets: DataSplitter, max_updates: int, max_new_ratio: float) -> str:
+        """
+        全データで学習し直す必要がある場合は、その理由を返す
+        """
+        if self.__train_end_date is None:
+            return 'no base model'
+        if datasets.X_train.columns.tolist() != self.__feature_names:
+            return 'feature columns changed'
+        if self.__n_updates >= max_updates:
+            return '{} incremental updates since full retrain'.format(self.__n_updates)
+        n_new = (datasets.train_data['date'] > self.__train_end_date).sum()
+        if n_new > self.__n_base_rows * max_new_ratio:
+            return '{} new rows exceed {:.0%} of the base rows'.format(n_new, max_new_ratio)
+        return None
+
+    def __auc_test(self, datasets: DataSplitter) -> float:
+        return roc_auc_score(datasets.y_test, self.__lgb_model.predict_proba(datasets.X_test_matrix)[:, 1])
+
+    def __update_feature_importance(self, datasets: DataSplitter):
         # 特徴量の重要度を記憶しておく
         self.__feature_importance = pd.DataFrame({
             "features": datasets.X_train.columns,
             "importance": self.__lgb_model.feature_importances_
             }).sort_values("importance", ascending=False)
-        print('AUC: {:.3f}(train), {:.3f}(test)'.format(auc_train, auc_test))
+
+    @property
+    def auc_history(self) -> pd.DataFrame:
+        """
+        全データでの学習・差分学習ごとのテストデータのAUC
+        """
+        return pd.DataFrame(self.__auc_history)
 
     @property
     def feature_importance(self):
@@ -73,6 +286,23 @@ class ModelWrapper:
     def lgb_model(self):
         return self.__lgb_model
 
+    @property
+    def model(self):
+        """
+        予測に使うモデル。アンサンブルを学習した場合はそのEnsembleModel。
+        1つのモデルで学習した場合も、1つのモデルだけのEnsembleModelにして返す。
+        LGBMClassifierにDataFrameを渡すとCategorical型の列はカテゴリのコードで予測されるので、
+        学習時と同じく、学習時の列を順に取り出してカテゴリの値の行列で予測するようにする。
+        ModelArtifactを読み込んだ場合は、lgb_modelをそのまま返す。
+        """
+        if self.__ensemble is not None:
+            return self.__ensemble
+        if isinstance(self.__lgb_model, lgb.LGBMClassifier) and self.__feature_names is not None:
+            return EnsembleModel(
+                [self.__lgb_model.booster_], self.__feature_names, self.__lgb_model.get_params()
+                )
+        return self.__lgb_model
+
     @lgb_model.setter
     def lgb_model(self, loaded):
         self.__lgb_model = loaded
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from ._data_splitter import DataSplitter, _sort_by_date, _to_matrix
+
+
+class WalkForwardSplitter:
+    """
+    時系列に沿って、訓練データとテストデータの組(fold)を複数作るクラス。
+    データを日付順に並べてn_splits+1個の期間に分け、k番目のfoldでは
+    k+1番目の期間をテストデータ、それより前の期間を訓練データにする。
+    期間の境目は日付の境目なので、同じ日のレースが訓練とテストに分かれることはない。
+    """
+    def __init__(self, featured_data: pd.DataFrame, n_splits: int = 5, window: int = None):
+        """
+        windowを指定した場合は、テスト期間の直前window個の期間だけを訓練データにする(スライディング)。
+        指定しない場合は、テスト期間より前の全期間を訓練データにする(拡大)。
+        """
+        self.__data = _sort_by_date(featured_data)
+        features = self.__data.drop(DataSplitter.NON_FEATURE_COLS, axis=1)
+        self.__feature_names = features.columns.tolist()
+        # 説明変数は一度だけfloat32の配列にして、各foldでは行の範囲で切り出す
+        self.__matrix = _to_matrix(features)
+        self.__labels = self.__data['rank'].to_numpy()
+
+        # レース数がおおよそ均等になるように、期間の境目の日付を決める
+        dates = self.__data['date'].to_numpy()
+        race_starts = np.flatnonzero(np.r_[True, self.__data.index[1:] != self.__data.index[:-1]])
+        n_races = len(race_starts)
+        boundary_dates = dates[race_starts[[round(n_races * k / (n_splits + 1)) for k in range(1, n_splits + 1)]]]
+        bounds = np.r_[0, np.searchsorted(dates, boundary_dates, side='left'), len(dates)]
+        if (np.diff(bounds) == 0).any():
+            raise ValueError('n_splits={} is too large for the number of race dates'.format(n_splits))
+
+        self.__folds = []
+        for k in range(1, n_splits + 1):
+            train_start = bounds[0] if window is None else bounds[max(0, k - window)]
+            self.__folds.append((train_start, bounds[k], bounds[k + 1]))
+
+    @property
+    def n_splits(self) -> int:
+        return len(self.__folds)
+
+    @property
+    def folds(self) -> pd.DataFrame:
+        """
+        各foldの訓練・テスト期間と行数
+        """
+        dates = self.__data['date']
+        return pd.DataFrame([
+            {
+                'train_start': dates.iloc[train_start],
+                'train_end': dates.iloc[test_start - 1],
+                'test_start': dates.iloc[test_start],
+                'test_end': dates.iloc[test_end - 1],
+                'n_train': test_start - train_start,
+                'n_test': test_end - test_start,
+            }
+            for train_start, test_start, test_end in self.__folds
+            ])
+
+    def split(self):
+        """
+        各foldの(訓練データ, テストデータ)を順に返す
+        """
+        for train_start, test_start, test_end in self.__folds:
+            yield self.__data.iloc[train_start:test_start], self.__data.iloc[test_start:test_end]
+
+    def train_arrays(self, fold: int) -> tuple:
+        """
+        foldの訓練データの(説明変数の配列, 目的変数の配列)
+        """
+        train_start, test_start, _ = self.__folds[fold]
+        return self.__matrix[train_start:test_start], self.__labels[train_start:test_start]
+
+    def test_arrays(self, fold: int) -> tuple:
+        """
+        foldのテストデータの(説明変数の配列, 目的変数の配列)
+        """
+        _, test_start, test_end = self.__folds[fold]
+        return self.__matrix[test_start:test_end], self.__labels[test_start:test_end]
+
+    def X_test(self, fold: int) -> pd.DataFrame:
+        """
+        foldのテストデータの説明変数。test_arraysの配列に、列名とrace_idをつけたもの。
+        """
+        _, test_start, test_end = self.__folds[fold]
+        return pd.DataFrame(
+            self.test_arrays(fold)[0],
+            index=self.__data.index[test_start:test_end],
+            columns=self.__feature_names
+            )